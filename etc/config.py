@@ -8,6 +8,8 @@ TARGER_URL = None
 EXCLUDE_PATHS = []
 DF_GROUP_BY = {}
 GOOGLE_PS_API_KEY = None
+TEMPLATE_SAMPLES = {}
+GROUPING_QUOTAS = {}
 
 # Import, parse and validate user's local config in this config file.
 try:
@@ -16,3 +18,16 @@ try:
 except ImportError:
     f_path = path.join(path.dirname(__file__), 'configlocal.py')
     raise ImportError(f"You need to create a local config file at: {f_path}.")
+
+# Optional settings, not found in older local config files.
+try:
+    # pylint: disable=unused-import
+    from .config_local import TEMPLATE_SAMPLES
+except ImportError:
+    pass
+
+try:
+    # pylint: disable=unused-import
+    from .config_local import GROUPING_QUOTAS
+except ImportError:
+    pass
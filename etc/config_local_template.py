@@ -14,3 +14,7 @@ EXCLUDE_PATHS = []
 DF_GROUP_BY = {}
 # Google PageSpeed Insights API key.
 GOOGLE_PS_API_KEY = None
+# Max number of pages measured per URL template, overriding --template_samples, e.g. {'/products/{slug}': 20}.
+TEMPLATE_SAMPLES = {}
+# Share of the pages processed per report grouping with '--scheduler priority', e.g. {'products': 3, 'blog': 1}.
+GROUPING_QUOTAS = {}
@@ -2,40 +2,189 @@
 Initialization file for library module.
 """
 import argparse
+from collections import namedtuple
 import datetime
+import functools
+import hashlib
 import logging
 from shutil import rmtree
+import sqlite3
+import threading
 from urllib.parse import urlparse
 import os
 
+import pandas as pd
 import requests
-from usp.tree import sitemap_tree_for_homepage as site_map_tree
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
+from selenium.webdriver.support.ui import WebDriverWait
 
 from etc import config
+from .browser_session import BrowserSession, RECYCLE_PAGES, RECYCLE_MEMORY_MB, SESSION_ERRORS
+from .crawl_store import CrawlStore
+from .http_session import session as http_session, HTTP_TIMEOUT_S
 from .url_management import UrlManagement
-from .google_insights import GoogleInsights
-from .metrics import process_page_metrics
+from .google_insights import GoogleInsights, GOOGLE_PS_API_STRATEGY
+from .http_engine import HttpEngine, extract_canonical
+from .insights_cache import InsightsCache
+from .link_checker import LinkChecker, LINK_CHECK_WORKERS
+from .metrics import process_page_metrics, reduce_insights, RESOURCE_RULES
+from .phase_timer import PhaseTimer
+from .profiling import RunProfiler
+from .result_store import ResultStore
+from .scheduler import PriorityScheduler, SCHEDULERS, SCHEDULER_FIFO, SCHEDULER_PRIORITY
+from .shard import Shard, run_shards, shard_dir, shards_dir
+from .sitemap import SitemapReader
+from .worker_pool import WorkerPool
 
 
 # usp.tree logging cannot be disabled in the standard way.
 logging.disable(logging.INFO)
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
-google_insights = GoogleInsights()
+phase_timer = PhaseTimer()
+google_insights = GoogleInsights(phase_timer)
 url_mgmt = UrlManagement()
+crawl_store = CrawlStore()
+insights_cache = InsightsCache()
 
 HEADLESS = True
 
-WAIT_S = 20
-
+# Max time for a page to load, the page is stopped and skipped after that.
+PAGE_LOAD_TIMEOUT_S = 30
+
+# Max time for the page metrics script.
+SCRIPT_TIMEOUT_S = 10
+
+# Interval between checks of the custom page load condition.
+LOAD_POLL_S = 0.1
+
+# Page load wait strategy: all resources loaded, DOM ready without waiting for resources (timings of the load
+# event are not available), or 'JS_LOAD_EVENT_END' polled while the browser does not wait.
+LOAD_NORMAL = 'normal'
+LOAD_EAGER = 'eager'
+LOAD_EVENT = 'load_event'
+LOAD_STRATEGIES = [LOAD_NORMAL, LOAD_EAGER, LOAD_EVENT]
+
+# WebDriver page load strategy of each wait strategy.
+PAGE_LOAD_STRATEGY = {LOAD_NORMAL: 'normal', LOAD_EAGER: 'eager', LOAD_EVENT: 'none'}
+
+# Marks the page loaded before, so that its load event is not mistaken for the one of the next page.
+JS_MARK_STALE = 'window.siteCrawlerStale = true;'
+
+JS_LOAD_EVENT_END = 'return !window.siteCrawlerStale && window.performance.timing.loadEventEnd > 0;'
+
+# Preferences of the browser profile template: no first run, update or telemetry work, and pages are measured with
+# an empty cache.
+FIREFOX_PREFERENCES = {
+    'app.update.auto': False,
+    'app.update.enabled': False,
+    'browser.cache.disk.enable': False,
+    'browser.cache.memory.enable': False,
+    'browser.sessionstore.resume_from_crash': False,
+    'browser.shell.checkDefaultBrowser': False,
+    'browser.startup.homepage_override.mstone': 'ignore',
+    'browser.startup.page': 0,
+    'browser.safebrowsing.malware.enabled': False,
+    'browser.safebrowsing.phishing.enabled': False,
+    'datareporting.healthreport.uploadEnabled': False,
+    'datareporting.policy.dataSubmissionEnabled': False,
+    'extensions.update.enabled': False,
+    'toolkit.telemetry.enabled': False
+}
+
+# The profile template is packed for geckodriver on each browser launch.
+profile_lock = threading.Lock()
+
+# Page status check before loading a page in the browser: a HEAD request, a GET request closed after the document
+# head is received, or none - relying on the status of the browser's navigation.
+PRECHECK_HEAD = 'head'
+PRECHECK_STREAM = 'stream'
+PRECHECK_NONE = 'none'
+PRECHECK_MODES = [PRECHECK_HEAD, PRECHECK_STREAM, PRECHECK_NONE]
+
+# Max bytes of a page read by the streamed pre-check to find its canonical URL.
+PRECHECK_HEAD_BYTES = 65536
+
+# Number of pages checked at once ahead of the browsers, see 'check_url()'.
+CHECK_WORKERS = 4
+
+# Page measurement engine: a Firefox instance, or plain HTTP requests without Insights metrics - see 'HttpEngine'.
+ENGINE_BROWSER = 'browser'
+ENGINE_HTTP = 'http'
+ENGINES = [ENGINE_BROWSER, ENGINE_HTTP]
+
+# Page version check for cached Insights results: age only, the ETag or Last-Modified response header of the
+# status pre-check, or a hash of the page HTML.
+CACHE_CHECK_NONE = 'none'
+CACHE_CHECK_HEADERS = 'headers'
+CACHE_CHECK_HASH = 'hash'
+CACHE_CHECK_MODES = [CACHE_CHECK_NONE, CACHE_CHECK_HEADERS, CACHE_CHECK_HASH]
+
+# Page snapshot taken in a single WebDriver round trip. Absolute link URLs are only collected if arguments[0] is set.
+# If the resource rules are passed in arguments[1], resources are classified and summed in the page - mirroring
+# 'metrics.process_page_resources()' - and only the totals per type and per distinct resource URL are returned.
 JS_PAGE_METRICS = """\
-    return {
+    const links = arguments[0] ? Array.from(document.querySelectorAll("a[href]"), link => link.href) : [];
+    const rules = arguments[1];
+    const resource = window.performance.getEntriesByType("resource");
+    const navigation = window.performance.getEntriesByType("navigation")[0];
+    const metrics = {
+        status: navigation ? navigation.responseStatus : undefined,
         pageTiming: window.performance.timing,
-        resource: window.performance.getEntriesByType("resource")
+        links: links.filter(href => href && typeof href === "string"),
+        finalUrl: window.location.href,
+        canonicalUrl: (document.querySelector('link[rel~="canonical" i]') || {}).href || null
+    };
+
+    if (!rules) {
+        metrics.resource = resource;
+        return metrics;
+    }
+
+    const summary = {};
+    const urls = new Map();
+    for (const entry of resource) {
+        const name = entry.name;
+        const endsWith = suffixes => suffixes.some(suffix => name.endsWith(suffix));
+
+        let type = entry.initiatorType.toLowerCase();
+        if (!rules.initiatorTypes.includes(type)) {
+            if (type === "xmlhttprequest") {
+                type = "xhrt";
+            } else if (endsWith(rules.fonts)) {
+                type = "font";
+            } else if (endsWith(rules.images)) {
+                type = "img";
+            } else if (name.endsWith(".css")) {
+                type = "css";
+            } else if (name.endsWith(".js")) {
+                type = "script";
+            } else {
+                type = "other";
+            }
+        }
+
+        const total = summary[type] || (summary[type] = {cnt: 0, duration: 0, size: 0});
+        total.cnt += 1;
+        total.duration += entry.duration;
+        total.size += entry.encodedBodySize;
+
+        if (!urls.has(name)) {
+            urls.set(name, [name, type, 0, 0, 0]);
+        }
+
+        const url = urls.get(name);
+        url[2] += 1;
+        url[3] += entry.encodedBodySize;
+        url[4] += entry.duration;
     }
+
+    metrics.resourceSummary = summary;
+    metrics.resourceUrls = Array.from(urls.values());
+    return metrics;
 """
 
 COLUMNS_ANALYSIS = [
@@ -44,11 +193,15 @@ COLUMNS_ANALYSIS = [
     'largest_contentful_paint_score', 'interactive', 'interactive_score', 'total_blocking_time',
     'total_blocking_time_score', 'cumulative_layout_shift', 'cumulative_layout_shift_score', 'first_input_delay',
     'first_input_delay_score', 'third_party_wasted',
-    'third_party_wasted_size', 'grouping', 'server', 'browser', 'usable', 'total', 'data_transfer', 'redirected', 'dom',
+    'third_party_wasted_size', 'grouping', 'template', 'server', 'browser', 'usable', 'total', 'data_transfer',
+    'redirected', 'dom',
     'img', 'img_sec', 'img_size', 'css', 'css_sec', 'css_size', 'script', 'script_sec', 'script_size', 'font',
     'font_sec', 'font_size', 'xhrt', 'xhrt_sec', 'xhrt_size'
 ]
 
+# Completed page results, see 'add_insights()'.
+analysis_results = ResultStore(COLUMNS_ANALYSIS, ['time', 'url', 'grouping', 'template'])
+
 
 def delete_reports():
     """Delete all reports."""
@@ -70,33 +223,116 @@ def process_args():
     parser.add_argument('-s', '--siteurl', help='Process specified website.')
     parser.add_argument('-m', '--max', type=int, default=0, help='Max number of URLs to process.')
     parser.add_argument('-f', '--follow', action='store_true', help='Follow internal URLs.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of parallel browser instances.')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default=ENGINE_BROWSER,
+                        help='Measure pages in the browser, or with plain HTTP requests without Insights metrics.')
+    parser.add_argument('-ls', '--load_strategy', choices=LOAD_STRATEGIES, default=LOAD_NORMAL,
+                        help='Page load wait strategy of the browser.')
+    parser.add_argument('-rp', '--recycle_pages', type=int, default=RECYCLE_PAGES,
+                        help='Number of pages after which the browser is relaunched.')
+    parser.add_argument('-rm', '--recycle_memory', type=int, default=RECYCLE_MEMORY_MB,
+                        help='Browser memory use, in MB, at which the browser is relaunched.')
+    parser.add_argument('-lo', '--links_only', action='store_true',
+                        help='Only check the status of links, without browser or PageSpeed Insights.')
+    parser.add_argument('-ar', '--aggregate_resources', action='store_true',
+                        help='Aggregate resource timings in the browser.')
+    parser.add_argument('-r', '--resume', action='store_true', help='Resume the previous crawl of the website.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only measure pages changed since the previous crawl of the website.')
+    parser.add_argument('-pc', '--precheck', choices=PRECHECK_MODES, default=PRECHECK_STREAM,
+                        help='Page status check before loading the page in the browser.')
+    parser.add_argument('-cw', '--check_workers', type=int, default=CHECK_WORKERS,
+                        help='Number of pages checked at once ahead of the browsers, 0 to check in the browsers.')
+    parser.add_argument('-qs', '--queue_size', type=int, default=0,
+                        help='Max number of checked pages waiting for a browser, defaults to 2 per browser.')
+    parser.add_argument('-ct', '--cache_ttl', type=float, default=0,
+                        help='Reuse PageSpeed Insights results up to this many hours old, 0 to disable.')
+    parser.add_argument('-cc', '--cache_check', choices=CACHE_CHECK_MODES, default=CACHE_CHECK_HEADERS,
+                        help='Page version check for cached PageSpeed Insights results.')
+    parser.add_argument('-sc', '--scheduler', choices=SCHEDULERS, default=SCHEDULER_FIFO,
+                        help='Order of the pages to process: as found, or by link depth, grouping quotas and '
+                             'time since last measured.')
+    parser.add_argument('-ts', '--template_samples', type=int, default=0,
+                        help='Max number of pages measured per URL template, 0 for no limit.')
+    parser.add_argument('-sh', '--shards', type=int, default=0,
+                        help='Split the crawl over this many processes, or nodes sharing the var directory.')
+    parser.add_argument('-si', '--shard_index', type=int,
+                        help='Only crawl this shard, from 0, the reports are merged with --merge_shards.')
+    parser.add_argument('-ms', '--merge_shards', action='store_true',
+                        help='Merge the crawl state of all shards into the reports.')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='Profile the run with cProfile, the statistics are saved with the reports.')
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug output.')
     parser.add_argument('-rr', '--remove_reports', action='store_true', help='Remove all reports.')
 
     return parser.parse_args()
 
 
-def conf_browser():
-    """Configure the browser instance."""
+@functools.lru_cache(maxsize=1)
+def profile_template():
+    """Minimal browser profile, created once and copied by every browser launch."""
+    profile = FirefoxProfile()
+    for name, value in FIREFOX_PREFERENCES.items():
+        profile.set_preference(name, value)
+
+    return profile
+
+
+def launch_browser(load_strategy=LOAD_NORMAL):
+    """Start a Firefox instance from the profile template."""
     ff_options = FirefoxOptions()
     ff_options.headless = HEADLESS
+    ff_options.set_capability('pageLoadStrategy', PAGE_LOAD_STRATEGY[load_strategy])
+
+    with profile_lock:
+        ff_options.profile = profile_template()
+        browser = webdriver.Firefox(options=ff_options)
 
-    browser = webdriver.Firefox(options=ff_options)
-    browser.implicitly_wait(WAIT_S)
+    browser.set_page_load_timeout(PAGE_LOAD_TIMEOUT_S)
+    browser.set_script_timeout(SCRIPT_TIMEOUT_S)
 
     return browser
 
 
-def load(browser, url):
+def conf_browser(engine=ENGINE_BROWSER, load_strategy=LOAD_NORMAL, recycle_pages=RECYCLE_PAGES,
+                 recycle_memory_mb=RECYCLE_MEMORY_MB):
+    """Configure the browser instance, the browser is started on first use - see 'BrowserSession'."""
+    if engine == ENGINE_HTTP:
+        return HttpEngine()
+
+    return BrowserSession(functools.partial(launch_browser, load_strategy), recycle_pages, recycle_memory_mb)
+
+
+def load(browser, url, load_strategy=LOAD_NORMAL):
     """Load the page into the browser instance."""
     loaded_ok = False
 
     try:
+        if load_strategy == LOAD_EVENT:
+            browser.execute_script(JS_MARK_STALE)
+
         browser.get(url)
+
+        if load_strategy == LOAD_EVENT:
+            WebDriverWait(browser, PAGE_LOAD_TIMEOUT_S, LOAD_POLL_S).until(
+                lambda driver: driver.execute_script(JS_LOAD_EVENT_END)
+            )
     except TimeoutException:
         logging.error('TimeoutException: Error loading: %s', url)
+
+        # Stop the hung page, so that it does not hold up the next page.
+        try:
+            browser.execute_script('window.stop();')
+        except Exception:
+            pass
     except requests.exceptions.RequestException:
         logging.error('RequestException: Error loading: %s', url)
+    except SESSION_ERRORS:
+        # The page is retried in a new browser session, see 'BrowserSession.process()'.
+        if not browser.alive():
+            raise
+
+        logging.error('Exception: Error loading: %s', url)
     except Exception:
         logging.error('Exception: Error loading: %s', url)
     else:
@@ -105,65 +341,312 @@ def load(browser, url):
     return loaded_ok
 
 
-def process_url(browser, url, follow_links, debug=False):
-    """Process a single URL."""
+def _read_head(response):
+    """Start of a page up to the end of its document head, at most 'PRECHECK_HEAD_BYTES'."""
+    content = b''
+    if 'html' in response.headers.get('Content-Type', 'text/html'):
+        for chunk in response.iter_content(chunk_size=8192):
+            content += chunk
+            if b'</head>' in content.lower() or len(content) >= PRECHECK_HEAD_BYTES:
+                break
+
+    return content.decode(response.encoding or 'utf-8', errors='replace')
+
+
+def check_status(url, precheck, fingerprint=False):
+    """
+    Request the status code and response headers of a page outside the browser.
+
+    Returns (status_code, headers, fingerprint, final_url, canonical_url), the page is only downloaded completely to
+    compute its content fingerprint if 'fingerprint' is set. The canonical URL is None if the page declares none.
+    """
+    if fingerprint:
+        request = http_session.get(url, timeout=HTTP_TIMEOUT_S)
+        return (request.status_code, request.headers, hashlib.sha1(request.content).hexdigest(), request.url,
+                extract_canonical(request, request.text))
+
+    if precheck == PRECHECK_HEAD:
+        request = http_session.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT_S)
+
+        # Not all servers support HEAD requests.
+        if request.status_code not in (405, 501):
+            return request.status_code, request.headers, None, request.url, extract_canonical(request)
+
+    # The connection is closed once the document head, with the canonical URL, is received.
+    with http_session.get(url, stream=True, timeout=HTTP_TIMEOUT_S) as request:
+        content = _read_head(request) if request.status_code == 200 else ''
+        return request.status_code, request.headers, None, request.url, extract_canonical(request, content)
+
+
+def page_version(cache_check, headers, fingerprint):
+    """
+    Identify the version of a page for cached Insights results, None if not available. The fingerprint is a hash of
+    the page as served, see 'check_status()' - in headers mode it is used for pages without validator header.
+    """
+    if cache_check == CACHE_CHECK_HEADERS and headers:
+        if headers.get('ETag'):
+            return 'etag:' + headers['ETag']
+
+        if headers.get('Last-Modified'):
+            return 'last-modified:' + headers['Last-Modified']
+
+    if cache_check != CACHE_CHECK_NONE and fingerprint:
+        return 'hash:' + fingerprint
+
+    return None
+
+
+def carry_forward(url, previous, follow_links, last_modified=None):
+    """Reuse the results of a page unchanged since the previous crawl, keeping their original timestamp."""
+    logging.info('Unchanged: %s', url)
+
+    url_mgmt.processed_pages(url)
+
+    if follow_links:
+        url_mgmt.unprocessed_pages(previous.links, depth=url_mgmt.page_depth(url) + 1)
+
+    crawl_store.add_page_state(url, last_modified or previous.last_modified, previous.fingerprint, previous.links)
+
+    # The Insights metrics are already part of the page results, only the audits are registered again.
+    page_results = previous.page_results
+    page_results.setdefault('template', url_mgmt.url_template(url))
+    add_insights(url, page_results, {'metrics': {}, 'audits': previous.audits})
+
+    return page_results
+
+
+# Outcome of 'check_url()' for pages to be measured, 'url' is the URL to measure the page under.
+PageCheck = namedtuple('PageCheck', ['url', 'headers', 'fingerprint', 'last_modified'])
+
+
+def check_url(url, follow_links, precheck=PRECHECK_STREAM, incremental=False, cache_check=CACHE_CHECK_HEADERS):
+    """
+    Check a page before measuring it, returns a 'PageCheck' or None if the page is not to be measured.
+
+    Unreachable pages are reported, and the results of pages unchanged since the previous crawl are carried forward.
+    URLs redirecting to, or declaring as canonical, another page are only measured once, under the URL of the page.
+    """
+    # Pages are unchanged if either their sitemap <lastmod> value or their content fingerprint matches.
+    last_modified = url_mgmt.last_modified(url)
+    previous = crawl_store.previous_page(url) if incremental else None
+    if previous and last_modified and last_modified == previous.last_modified:
+        carry_forward(url, previous, follow_links)
+        return None
+
+    # Fingerprints are only computed when used, the page is then downloaded completely - they identify the page
+    # version for cached Insights results too.
+    headers = fingerprint = None
+    if precheck != PRECHECK_NONE:
+        try:
+            with phase_timer.phase(url, 'precheck'):
+                status_code, headers, fingerprint, final_url, canonical_url = check_status(
+                    url, precheck, incremental or cache_check == CACHE_CHECK_HASH
+                )
+        except requests.RequestException as ex:
+            url_mgmt.unreachable_pages(url, ex)
+            logging.error('Error loading: %s - status: %s', url, ex)
+            return None
+
+        if status_code != 200:
+            url_mgmt.unreachable_pages(url, status_code)
+            logging.error('Error loading: %s - status: %s', url, status_code)
+
+            return None
+
+        # The page is checked again under its own URL, e.g. for the status of a canonical URL.
+        page_url = url_mgmt.resolve_alias(url, final_url, canonical_url)
+        if page_url != url:
+            if not page_url:
+                return None
+
+            check = check_url(page_url, follow_links, precheck, incremental, cache_check)
+            if check or not url_mgmt.is_unreachable(page_url):
+                return check
+
+            # A dead URL resolved to, e.g. a broken canonical link, is reported - the page is measured under its URL.
+            url_mgmt.drop_alias(url)
+
+        if previous and fingerprint == previous.fingerprint:
+            carry_forward(url, previous, follow_links, last_modified)
+            return None
+
+    return PageCheck(url, headers, fingerprint, last_modified)
+
+
+def process_url(browser, url, follow_links, debug=False, aggregate_resources=False, precheck=PRECHECK_STREAM,
+                cache_check=CACHE_CHECK_HEADERS, incremental=False, load_strategy=LOAD_NORMAL, check=None):
+    """Process a single URL, pages not checked by 'check_url()' beforehand are checked first."""
     logging.info('Processing: %s', url)
 
-    try:
-        request = requests.get(url)
-    except requests.RequestException as ex:
-        url_mgmt.unreachable_pages(url, ex)
-        logging.error('Error loading: %s - status: %s', url, ex)
-        return {}
+    if not check:
+        check = check_url(url, follow_links, precheck, incremental, cache_check)
+        if not check:
+            return {}
 
-    if request.status_code != 200:
-        url_mgmt.unreachable_pages(url, request.status_code)
-        logging.error('Error loading: %s - status: %s', url, request.status_code)
+    url, headers, fingerprint, last_modified = check
 
-        return {}
+    http_engine = isinstance(browser, HttpEngine)
+    if http_engine:
+        try:
+            with phase_timer.phase(url, 'load'):
+                timing_api_metrics = browser.measure(url)
+        except requests.RequestException as ex:
+            url_mgmt.unreachable_pages(url, ex)
+            logging.error('Error loading: %s - status: %s', url, ex)
+            return {}
 
-    loaded_ok = load(browser, url)
+    else:
+        with phase_timer.phase(url, 'load'):
+            loaded_ok = load(browser, url, load_strategy)
+
+        if not loaded_ok:
+            return {}
+
+        resource_rules = RESOURCE_RULES if aggregate_resources else None
+        with phase_timer.phase(url, 'snapshot'):
+            try:
+                timing_api_metrics = browser.execute_script(JS_PAGE_METRICS, follow_links, resource_rules)
+            except SESSION_ERRORS as ex:
+                # The page is retried in a new browser session, see 'BrowserSession.process()'.
+                if not browser.alive():
+                    raise
+
+                # E.g. a script timeout, the page is still measured by Insights.
+                logging.error('Exception: Error reading the page metrics: %s - %s', url, ex)
+                timing_api_metrics = {}
+
+    # Navigation status is not available in all browser versions.
+    status_code = timing_api_metrics.get('status')
+    if (precheck == PRECHECK_NONE or http_engine) and status_code and status_code != 200:
+        url_mgmt.unreachable_pages(url, status_code)
+        logging.error('Error loading: %s - status: %s', url, status_code)
+
+        return {}
 
-    if not loaded_ok:
+    # Pages loaded without pre-check, or only redirected in the browser, are resolved once loaded. The page loaded is
+    # that of the final URL, canonical URLs are queued to be checked first.
+    page_url = url_mgmt.resolve_alias(
+        url, timing_api_metrics.get('finalUrl'), timing_api_metrics.get('canonicalUrl'), claim_canonical=False
+    )
+    if not page_url:
         return {}
 
-    grouping = 'Not categorised'
-    for key, value in config.DF_GROUP_BY.items():
-        if value in url:
-            grouping = key
+    if page_url != url:
+        url = page_url
+        last_modified = url_mgmt.last_modified(url)
+
+    grouping = url_mgmt.url_grouping(url)
 
     url_path = urlparse(url).path
     url_path = url_path if url_path else 'root'
 
-    timing_api_metrics = browser.execute_script(JS_PAGE_METRICS)
-    google_insights_metrics = google_insights.page_performance(url, debug)
+    with phase_timer.phase(url, 'links'):
+        url_mgmt.processed_pages(url)
 
-    url_mgmt.processed_pages(url)
+        links = timing_api_metrics.get('links', [])
+        if follow_links:
+            url_mgmt.unprocessed_pages(links, depth=url_mgmt.page_depth(url) + 1)
+
+        crawl_store.add_page_state(url, last_modified, fingerprint, links)
+
+    with phase_timer.phase(url, 'metrics'):
+        page_results = {
+            'time': format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            'url': url_path,
+            'grouping': grouping,
+            'template': url_mgmt.url_template(url),
+            **process_page_metrics(url_path, timing_api_metrics, None, url_mgmt)
+        }
+
+    crawl_store.add_result(url, page_results, insights_pending=True)
+
+    # The HTTP engine is meant for fast sweeps, Insights are left to the browser measurements of selected pages.
+    if http_engine:
+        add_insights(url, page_results, None)
+        return page_results
+
+    # Pages pre-checked without version, e.g. sending neither ETag nor Last-Modified, are not known to be unchanged.
+    version = page_version(cache_check, headers, fingerprint)
+    cached = version or cache_check == CACHE_CHECK_NONE or headers is None
+    insights = insights_cache.get(url, GOOGLE_PS_API_STRATEGY, version) if cached else None
+    if insights:
+        add_insights(url, page_results, insights)
+
+    else:
+        # Insights metrics are added to the page results in the background - see 'report_results()'.
+        google_insights.submit(url, debug, functools.partial(merge_insights, url, page_results, version))
+
+    return page_results
+
+
+def merge_insights(url, page_results, version, future):
+    """Join the Google Page Speed Insights response back to the page results."""
+    google_insights_metrics = future.result()
+
+    # Errors are not raised in this callback, where they would be dropped along with the page results.
+    with phase_timer.phase(url, 'insights_metrics'):
+        insights = None
+        if google_insights_metrics:
+            try:
+                insights = reduce_insights(google_insights_metrics)
+            except Exception as ex:
+                # E.g. Lighthouse runtime errors, reported with a null score.
+                logging.error('Google Insights API: Invalid response, URL: %s - %s', url, ex)
+
+        if insights:
+            try:
+                insights_cache.put(url, GOOGLE_PS_API_STRATEGY, version, insights)
+            except sqlite3.Error as ex:
+                logging.error('Insights cache: Error caching: %s - %s', url, ex)
+
+        add_insights(url, page_results, insights)
 
-    if follow_links:
-        links_referenced = browser.find_elements_by_tag_name('a')
-        links = [link.get_attribute('href') for link in links_referenced if link.get_attribute('href')]
-        url_mgmt.unprocessed_pages(links)
-
-    return {
-        'time': format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-        'url': url_path,
-        'grouping': grouping,
-        **process_page_metrics(url_path, timing_api_metrics, google_insights_metrics, url_mgmt)
-    }
+
+def add_insights(url, page_results, insights):
+    """Add the Insights metrics and audits to the page results, and record the completed page."""
+    # Audits and page results are stored together, see 'CrawlStore.commit()'.
+    with url_mgmt.lock:
+        if insights:
+            page_results.update(process_page_metrics(page_results['url'], None, insights, url_mgmt))
+
+        crawl_store.add_result(url, page_results)
+        url_mgmt.stream_report('analysis', COLUMNS_ANALYSIS, [page_results])
+        analysis_results.append(page_results)
+
+    if crawl_store.commit_due():
+        crawl_store.commit(url_mgmt)
+
+
+def conf_scheduler(scheduler=SCHEDULER_FIFO):
+    """Set the order of the frontier, the crawl state must be open for the time pages were last measured."""
+    if scheduler == SCHEDULER_PRIORITY:
+        url_mgmt.set_scheduler(
+            PriorityScheduler(url_mgmt.url_grouping, config.GROUPING_QUOTAS, crawl_store.last_measured())
+        )
+
+
+def resume_crawl(debug=False):
+    """Restore the stored crawl state and return the number of pages measured, missing insights are requested again."""
+    results = crawl_store.restore(url_mgmt)
+    for url, page_results, insights_pending in results:
+        if insights_pending:
+            google_insights.submit(url, debug, functools.partial(merge_insights, url, page_results, None))
+        else:
+            url_mgmt.stream_report('analysis', COLUMNS_ANALYSIS, [page_results])
+            analysis_results.append(page_results)
+
+    return len(results)
 
 
 def process_sitemap(site_url, max_urls):
-    """Iterate through and process all pages in a website's sitemap."""
+    """Iterate through all pages in a website's sitemap, page URLs are yielded as each sitemap is parsed."""
     counter = 0
 
     target_url = site_url if site_url else config.TARGER_URL
-    site_map = site_map_tree(target_url)
-    res = []
 
-    for page in site_map.all_pages():
+    for page in SitemapReader(target_url).pages():
         page_url = page.url.lower()
-        if page_url in url_mgmt.processed_pages():
+        if url_mgmt.is_seen(page_url) or not url_mgmt.in_shard(page_url):
             continue
 
         # max_urls apply only to non duplicate/excluded URLs.
@@ -172,13 +655,76 @@ def process_sitemap(site_url, max_urls):
             if counter > max_urls:
                 break
 
-        res.append(page_url)
+        # Used to skip unchanged pages in incremental crawls.
+        url_mgmt.last_modified(page_url, page.last_modified)
+
+        yield page_url
+
+
+def check_links(follow_links, max_urls, progress=None, sources=(), shard=None):
+    """Crawl the frontier without browser, reporting the status of all links found."""
+    link_checker = LinkChecker(url_mgmt, follow_links)
+    worker_pool = WorkerPool(url_mgmt, link_checker.check_page, max_urls)
+
+    # Links found by the other shards, until all shards are done.
+    if shard:
+        inbox = shard.inbox(worker_pool)
+        sources = list(sources) + [inbox if follow_links else link_checker.check_sent_links(inbox)]
+
+    # Pages are downloaded by plain worker threads, there are no browser instances.
+    worker_pool.run([None] * LINK_CHECK_WORKERS, progress, sources)
+    link_checker.wait()
+
+    url_mgmt.generate_internal_reports()
 
-    return res
 
+def merge_shards(domain_name, shard_cnt):
+    """
+    Report on the crawl state of all shards as a single crawl.
+
+    Pages are processed by a single shard, so that the counters of the shards add up to the ones of a single process.
+    """
+    for index in range(shard_cnt):
+        dir_path = shard_dir(domain_name, index)
+        if not os.path.exists(CrawlStore.db_path(dir_path)):
+            logging.error('Shards: No crawl state of shard %s in: %s', index, dir_path)
+            continue
+
+        store = CrawlStore()
+        store.open(dir_path, resume=True)
+        try:
+            for _, page_results, _ in store.restore(url_mgmt):
+                url_mgmt.stream_report('analysis', COLUMNS_ANALYSIS, [page_results])
+                analysis_results.append(page_results)
+        finally:
+            store.close()
+
+    data_frame = analysis_results.data_frame()
+    url_mgmt.analysis_report(data_frame)
+    url_mgmt.template_report(data_frame)
+    url_mgmt.generate_internal_reports()
 
-def report_results(results):
+
+def report_results():
     """Process the result data."""
-    url_mgmt.analysis_report(COLUMNS_ANALYSIS, results)
-    url_mgmt.generate_report('analysis', COLUMNS_ANALYSIS, results)
+    google_insights.wait()
+
+    data_frame = analysis_results.data_frame()
+    url_mgmt.analysis_report(data_frame)
+    url_mgmt.template_report(data_frame)
     url_mgmt.generate_internal_reports()
+
+    phase_report()
+
+
+def phase_report():
+    """Report the time spent in each phase of processing the pages."""
+    summary = phase_timer.summary()
+    if summary:
+        print('\nPhases:')
+        data_frame = pd.DataFrame(summary, columns=PhaseTimer.COLUMNS_SUMMARY)
+        print(data_frame.to_string(index=False, float_format='{:.3f}'.format))
+
+    url_mgmt.generate_report('phase_summary', PhaseTimer.COLUMNS_SUMMARY, summary)
+    url_mgmt.generate_report('phase_timing', PhaseTimer.COLUMNS_PHASES, phase_timer.timings())
+    phase_timer.write_prometheus(url_mgmt.report_path('phase_timing', 'prom', timestamp=False))
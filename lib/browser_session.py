@@ -0,0 +1,168 @@
+"""
+Managed browser sessions.
+"""
+import logging
+import os
+
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import HTTPError
+
+# Errors raised by WebDriver calls once the browser crashed or geckodriver died.
+SESSION_ERRORS = (WebDriverException, HTTPError, ConnectionError)
+
+# Pages measured before the browser is relaunched.
+RECYCLE_PAGES = 200
+
+# Memory use, in megabytes, of the browser and its content processes at which it is relaunched.
+RECYCLE_MEMORY_MB = 1536
+
+# Number of times a page is retried after the browser session was lost.
+SESSION_RETRIES = 1
+
+# Clears the storage of the page measured last, cookies are cleared through WebDriver.
+JS_CLEAR_STORAGE = """\
+    try {
+        window.localStorage.clear();
+        window.sessionStorage.clear();
+    } catch (ex) {}
+"""
+
+
+def _process_memory_kb(pid):
+    """Resident memory of a process and all its child processes, 0 if not available."""
+    memory_kb = 0
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    memory_kb = int(line.split()[1])
+
+        for task in os.listdir('/proc/{}/task'.format(pid)):
+            with open('/proc/{}/task/{}/children'.format(pid, task)) as children:
+                for child in children.read().split():
+                    memory_kb += _process_memory_kb(child)
+    except (OSError, ValueError):
+        pass
+
+    return memory_kb
+
+
+class BrowserSession:
+    """
+    Browser instance that is relaunched when its session is lost, and recycled after a number of pages or when it
+    uses too much memory. Cookies and storage are cleared between pages.
+    """
+
+
+    def __init__(self, launch, recycle_pages=RECYCLE_PAGES, recycle_memory_mb=RECYCLE_MEMORY_MB):
+        # Callable starting a new WebDriver instance.
+        self._launch = launch
+
+        self._recycle_pages = recycle_pages
+        self._recycle_memory_mb = recycle_memory_mb
+
+        # Started on first use.
+        self._driver = None
+
+        # Pages measured by the current WebDriver instance.
+        self._page_cnt = 0
+
+
+    @property
+    def driver(self):
+        """Current WebDriver instance, started if needed."""
+        if not self._driver:
+            self._driver = self._launch()
+            self._page_cnt = 0
+
+        return self._driver
+
+
+    def get(self, url):
+        """Load a page, see 'webdriver.Firefox.get()'."""
+        self.driver.get(url)
+
+
+    def execute_script(self, script, *args):
+        """Run a script in the page, see 'webdriver.Firefox.execute_script()'."""
+        return self.driver.execute_script(script, *args)
+
+
+    def alive(self):
+        """Check if the browser still responds."""
+        if not self._driver:
+            return False
+
+        try:
+            self._driver.current_url
+        except SESSION_ERRORS:
+            return False
+
+        return True
+
+
+    def memory_mb(self):
+        """Memory used by the browser, 0 if not available."""
+        pid = self._driver.capabilities.get('moz:processID') if self._driver else None
+        return _process_memory_kb(pid) / 1024.0 if pid else 0
+
+
+    def _clear(self):
+        """Clear the cookies and storage of the page measured last."""
+        try:
+            self._driver.delete_all_cookies()
+            self._driver.execute_script(JS_CLEAR_STORAGE)
+        except SESSION_ERRORS as ex:
+            logging.warning('Browser: Error clearing the page state - %s', ex)
+
+
+    def _page_done(self):
+        """Recycle the browser if it is due, otherwise clear it for the next page."""
+        self._page_cnt += 1
+
+        memory_mb = self.memory_mb()
+        if self._page_cnt >= self._recycle_pages or memory_mb > self._recycle_memory_mb:
+            logging.info('Browser: Recycling after %s pages, %.0f MB used.', self._page_cnt, memory_mb)
+            self.quit()
+
+        elif self._driver:
+            self._clear()
+
+
+    def process(self, url, process_page, **kwargs):
+        """
+        Process a page with 'process_page(browser, url, **kwargs)', the page is retried if the browser session is lost.
+
+        Errors of a page, e.g. a script timeout, only skip that page: no results are returned.
+        """
+        results = {}
+        for attempt in range(SESSION_RETRIES + 1):
+            try:
+                results = process_page(self, url, **kwargs)
+                break
+            except SESSION_ERRORS as ex:
+                if self.alive():
+                    logging.error('Browser: Error processing: %s - %s', url, ex)
+                    break
+
+                self.quit()
+                if attempt == SESSION_RETRIES:
+                    logging.error('Browser: Session lost, skipping: %s', url)
+                    break
+
+                logging.warning('Browser: Session lost, relaunching: %s', url)
+
+        self._page_done()
+
+        return results
+
+
+    def quit(self):
+        """Stop the browser, a new instance is started on next use."""
+        if self._driver:
+            try:
+                self._driver.quit()
+            except SESSION_ERRORS:
+                pass
+
+            self._driver = None
@@ -0,0 +1,370 @@
+"""
+Persistent crawl state.
+"""
+from collections import namedtuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from .url_management import audit_detail_key
+
+# Number of completed pages between commits to disk.
+COMMIT_PAGES = 10
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS frontier (position INTEGER PRIMARY KEY, url TEXT NOT NULL);
+    CREATE INDEX IF NOT EXISTS frontier_url ON frontier (url);
+    CREATE TABLE IF NOT EXISTS frontier_depth (url TEXT PRIMARY KEY, depth INTEGER);
+    CREATE TABLE IF NOT EXISTS processed (url TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS unreachable (url TEXT PRIMARY KEY, status_code TEXT, cnt INTEGER);
+    CREATE TABLE IF NOT EXISTS external (url TEXT PRIMARY KEY, cnt INTEGER, status_code TEXT);
+    CREATE TABLE IF NOT EXISTS alias (url TEXT PRIMARY KEY, page_url TEXT, type TEXT);
+    CREATE TABLE IF NOT EXISTS sampled_out (url TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS resource (
+        url TEXT PRIMARY KEY, type TEXT, cnt INTEGER, pages INTEGER, total_size REAL, total_sec REAL,
+        sample_src_url TEXT
+    );
+    CREATE TABLE IF NOT EXISTS audit_definition (id TEXT PRIMARY KEY, title TEXT, description TEXT);
+    CREATE TABLE IF NOT EXISTS audit_detail (detail_key TEXT PRIMARY KEY, detail TEXT);
+    CREATE TABLE IF NOT EXISTS audit_finding (
+        position INTEGER PRIMARY KEY, url TEXT, id TEXT, finding TEXT, saving_ms REAL, detail_key TEXT
+    );
+    CREATE INDEX IF NOT EXISTS audit_finding_url ON audit_finding (url);
+    CREATE TABLE IF NOT EXISTS result (url TEXT PRIMARY KEY, insights_pending INTEGER, row TEXT);
+    CREATE TABLE IF NOT EXISTS page_state (url TEXT PRIMARY KEY, last_modified TEXT, fingerprint TEXT, links TEXT);
+"""
+
+# Audit results joined with their definition and detail item.
+AUDIT_QUERY = (
+    'SELECT audit_finding.url, audit_finding.id, audit_definition.title, audit_finding.finding, '
+    'audit_finding.saving_ms, audit_definition.description, audit_detail.detail FROM audit_finding '
+    'JOIN audit_definition ON audit_definition.id = audit_finding.id '
+    'JOIN audit_detail ON audit_detail.detail_key = audit_finding.detail_key '
+)
+
+# Measured page of the previous crawl, 'audits' is a list of (audit item, detail item) tuples.
+PreviousPage = namedtuple('PreviousPage', ['last_modified', 'fingerprint', 'links', 'page_results', 'audits'])
+
+
+def _status_text(status_code):
+    """Stored form of a status: either an HTTP status code or a request exception message."""
+    return None if status_code is None else str(status_code)
+
+
+def _status_code(status_text):
+    """Status restored from its stored form, see '_status_text()'."""
+    return int(status_text) if status_text and status_text.isdigit() else status_text
+
+
+def _audit_item(audit_id, title, finding, saving_ms, description):
+    """Audit item, as found in the Insights API response, of a stored audit result."""
+    return {
+        'id': audit_id,
+        'title': title,
+        'displayValue': finding,
+        'overallSavingsMs': saving_ms,
+        'description': description
+    }
+
+
+class CrawlStore:
+    """Keep the crawl state in a local SQLite database, so that an interrupted crawl can be resumed."""
+
+
+    def __init__(self):
+        self._connection = None
+        self._lock = threading.Lock()
+
+        # Serialises commits, so that snapshots are written in order.
+        self._commit_lock = threading.Lock()
+
+        # Crawl state of the previous crawl, only opened for incremental crawls.
+        self._previous_connection = None
+        self._previous_path = None
+
+        # Page results, by URL, changed since the last commit.
+        self._dirty_results = {}
+
+        # Insights pending flag of the page results, by URL.
+        self._insights_pending = {}
+
+        # Number of audit results already written.
+        self._audit_cnt = 0
+
+        # Number of pages completed since the last commit.
+        self._page_cnt = 0
+
+        # Page state - (last_modified, fingerprint, links) - by URL, changed since the last commit.
+        self._dirty_page_states = {}
+
+
+    @staticmethod
+    def db_path(dir_path):
+        """Location of the crawl state database in a data directory, see 'UrlManagement.data_dir()'."""
+        return os.path.join(dir_path, 'crawl_state.sqlite3')
+
+
+    @staticmethod
+    def previous_db_path(dir_path):
+        """Location of the crawl state database of the previous crawl in a data directory."""
+        return os.path.join(dir_path, 'crawl_state.previous.sqlite3')
+
+
+    def open(self, dir_path, resume=False, incremental=False):
+        """
+        Open the crawl state database of a data directory, a new crawl starts with an empty state.
+
+        The state of the previous crawl is kept, see 'previous_page()' for incremental crawls and 'last_measured()'.
+        """
+        path = self.db_path(dir_path)
+        previous_path = self._previous_path = self.previous_db_path(dir_path)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        if not resume and os.path.exists(path):
+            os.replace(path, previous_path)
+
+        # Pages complete on the crawl worker threads, access is serialised on the store lock.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._audit_cnt = self._connection.execute('SELECT COUNT(*) FROM audit_finding').fetchone()[0]
+
+        if incremental and os.path.exists(previous_path):
+            self._previous_connection = sqlite3.connect(previous_path, check_same_thread=False)
+            self._previous_connection.executescript(SCHEMA)
+
+
+    def previous_page(self, url):
+        """Results and page state of a page measured in the previous crawl, or None."""
+        if not self._previous_connection:
+            return None
+
+        with self._lock:
+            query = self._previous_connection.execute
+            row = query(
+                'SELECT page_state.last_modified, page_state.fingerprint, page_state.links, result.row '
+                'FROM result JOIN page_state ON page_state.url = result.url '
+                'WHERE result.url = ? AND result.insights_pending = 0', (url,)
+            ).fetchone()
+
+            if not row:
+                return None
+
+            last_modified, fingerprint, links, page_results = row
+            page_results = json.loads(page_results)
+
+            # Audit results are stored by URL path, as in the page results.
+            audits = [
+                (_audit_item(audit_id, title, finding, saving_ms, description), json.loads(detail))
+                for _, audit_id, title, finding, saving_ms, description, detail in query(
+                    AUDIT_QUERY + 'WHERE audit_finding.url = ? ORDER BY audit_finding.position', (page_results['url'],)
+                )
+            ]
+
+        return PreviousPage(last_modified, fingerprint, json.loads(links), page_results, audits)
+
+
+    def last_measured(self):
+        """Time, as in the page results, each page was measured in the previous crawl by URL."""
+        if not self._previous_path or not os.path.exists(self._previous_path):
+            return {}
+
+        connection = sqlite3.connect(self._previous_path)
+        try:
+            return dict(connection.execute(
+                "SELECT url, json_extract(row, '$.time') FROM result WHERE insights_pending = 0"
+            ))
+        except sqlite3.Error as ex:
+            logging.warning('Crawl state: Previous crawl not available - %s', ex)
+            return {}
+        finally:
+            connection.close()
+
+
+    def add_result(self, url, page_results, insights_pending=False):
+        """Register new or updated page results, the state is committed every 'COMMIT_PAGES' pages."""
+        with self._lock:
+            self._dirty_results[url] = page_results
+            self._insights_pending[url] = insights_pending
+
+            if not insights_pending:
+                self._page_cnt += 1
+
+
+    def add_page_state(self, url, last_modified, fingerprint, links):
+        """Register the sitemap <lastmod> value, content fingerprint and links of a page for the next crawl."""
+        with self._lock:
+            self._dirty_page_states[url] = (last_modified, fingerprint, json.dumps(links))
+
+
+    def commit_due(self):
+        """Check if enough pages were completed to commit the state."""
+        return self._page_cnt >= COMMIT_PAGES
+
+
+    def commit(self, url_mgmt):
+        """
+        Write the crawl state changed since the last commit to disk.
+
+        Pages stay in the stored frontier from being queued until done, so that pages in progress are processed again
+        when resuming.
+        """
+        if not self._connection:
+            return
+
+        with self._commit_lock:
+            # Only the snapshot holds the URL management lock - a consistent view of the registries and page results.
+            with url_mgmt.lock, self._lock:
+                changes = url_mgmt.state_changes()
+                audits = url_mgmt.audit_results(start=self._audit_cnt)
+                results = [
+                    (url, int(self._insights_pending[url]), json.dumps(page_results))
+                    for url, page_results in self._dirty_results.items()
+                ]
+                page_states = [(url, *page_state) for url, page_state in self._dirty_page_states.items()]
+
+                self._audit_cnt += len(audits)
+                self._dirty_results = {}
+                self._dirty_page_states = {}
+                self._page_cnt = 0
+
+            with self._connection:
+                done = [(url,) for url in changes.done]
+                self._connection.executemany('DELETE FROM frontier WHERE url = ?', done)
+                self._connection.executemany('DELETE FROM frontier_depth WHERE url = ?', done)
+                self._connection.executemany(
+                    'INSERT INTO frontier (url) VALUES (?)', [(url,) for url, _ in changes.queued]
+                )
+                self._connection.executemany('INSERT OR REPLACE INTO frontier_depth VALUES (?, ?)', changes.queued)
+
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO processed VALUES (?)', [(url,) for url in changes.processed]
+                )
+
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO unreachable VALUES (?, ?, ?)',
+                    [(page['url'], _status_text(page['status_code']), page['cnt']) for page in changes.unreachable]
+                )
+
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO external VALUES (?, ?, ?)',
+                    [(page['url'], page['cnt'], _status_text(page['status_code'])) for page in changes.external]
+                )
+
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO alias VALUES (?, ?, ?)',
+                    [(alias['url'], alias['page_url'], alias['type']) for alias in changes.aliases]
+                )
+                self._connection.executemany(
+                    'DELETE FROM alias WHERE url = ?', [(url,) for url in changes.dropped_aliases]
+                )
+
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO sampled_out VALUES (?)', [(url,) for url in changes.sampled_out]
+                )
+
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO resource VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (resource['url'], resource['type'], resource['cnt'], resource['pages'],
+                         resource['total_size'], resource['total_sec'], resource['sample_src_url'])
+                        for resource in changes.resources
+                    ]
+                )
+
+                # Audit titles, descriptions and detail items are stored once.
+                detail_keys = [audit_detail_key(audit['detail']) for audit in audits]
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO audit_definition VALUES (?, ?, ?)',
+                    {(audit['id'], audit['title'], audit['description']) for audit in audits}
+                )
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO audit_detail VALUES (?, ?)',
+                    {
+                        detail_key: (detail_key, json.dumps(audit['detail']))
+                        for detail_key, audit in zip(detail_keys, audits)
+                    }.values()
+                )
+                self._connection.executemany(
+                    'INSERT INTO audit_finding (url, id, finding, saving_ms, detail_key) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (audit['url'], audit['id'], audit['finding'], audit['saving_ms'], detail_key)
+                        for detail_key, audit in zip(detail_keys, audits)
+                    ]
+                )
+
+                self._connection.executemany('INSERT OR REPLACE INTO result VALUES (?, ?, ?)', results)
+                self._connection.executemany('INSERT OR REPLACE INTO page_state VALUES (?, ?, ?, ?)', page_states)
+
+
+    def restore(self, url_mgmt):
+        """
+        Load the stored crawl state into URL management.
+
+        Returns a list of (url, page_results, insights_pending) tuples for the pages already measured.
+        """
+        query = self._connection.execute
+
+        for (url,) in query('SELECT url FROM processed'):
+            url_mgmt.processed_pages(url)
+
+        for url, status_code, cnt in query('SELECT url, status_code, cnt FROM unreachable'):
+            url_mgmt.unreachable_pages(url, _status_code(status_code), cnt)
+
+        for url, cnt, status_code in query('SELECT url, cnt, status_code FROM external'):
+            url_mgmt.external_pages(url, cnt, _status_code(status_code))
+
+        for url, page_url, alias_type in query('SELECT url, page_url, type FROM alias'):
+            url_mgmt.alias_pages(url, page_url, alias_type)
+
+        resources = query('SELECT url, type, cnt, pages, total_size, total_sec, sample_src_url FROM resource')
+        for url, resource_type, cnt, pages, total_size, total_sec, sample_src_url in resources:
+            url_mgmt.processed_resource_references(
+                sample_src_url, url, resource_type, cnt, total_size, total_sec, pages
+            )
+
+        audits = query(AUDIT_QUERY + 'ORDER BY audit_finding.position')
+        for url, audit_id, title, finding, saving_ms, description, detail in audits:
+            item = _audit_item(audit_id, title, finding, saving_ms, description)
+            url_mgmt.audit_results(url, item, json.loads(detail))
+
+        frontier = query(
+            'SELECT frontier.url, frontier_depth.depth FROM frontier LEFT JOIN frontier_depth USING (url) '
+            'ORDER BY frontier.position'
+        )
+        for url, depth in frontier:
+            url_mgmt.unprocessed_pages(url, depth=depth or 0)
+
+        for (url,) in query('SELECT url FROM sampled_out'):
+            url_mgmt.sampled_out_pages(url)
+
+        results = [
+            (url, json.loads(page_results), bool(insights_pending))
+            for url, insights_pending, page_results in query('SELECT url, insights_pending, row FROM result')
+        ]
+
+        with self._lock:
+            self._insights_pending = {url: insights_pending for url, _, insights_pending in results}
+
+        # The restored state is stored already, only later changes are committed.
+        url_mgmt.state_changes()
+
+        logging.warning('Crawl state: Restored %s pages measured.', len(results))
+
+        return results
+
+
+    def close(self, url_mgmt=None):
+        """Commit the final crawl state, unless no URL management is given, and close the database."""
+        if self._connection:
+            if url_mgmt:
+                self.commit(url_mgmt)
+
+            self._connection.close()
+            self._connection = None
+
+        if self._previous_connection:
+            self._previous_connection.close()
+            self._previous_connection = None
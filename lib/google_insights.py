@@ -1,32 +1,104 @@
 """
 Class to manage Google PageSpeed Insights.
 """
+from concurrent.futures import Future, ThreadPoolExecutor
 import datetime
 import json
 import logging
 import os
+import threading
 import time
 from urllib.parse import urlparse
 import requests
 import tldextract
 
 from etc import config
+from .http_session import session as http_session
+from .phase_timer import PhaseTimer
 
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
 GOOGLE_PS_API_URL = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed'
 
-# Minimum time between calls to Google Insights API.
-GOOGLE_PS_API_WAIT_S = 5
+# 'DESKTOP' or 'MOBILE'.
+GOOGLE_PS_API_STRATEGY = 'DESKTOP'
+
+# API quota: 400 queries per 100 seconds - sustained calls per second and allowed burst.
+GOOGLE_PS_API_RATE_S = 4.0
+GOOGLE_PS_API_BURST = 4
+
+# Max seconds for a single API call, Lighthouse runs can take a minute.
+GOOGLE_PS_API_TIMEOUT_S = 180
+
+# Number of API calls in flight at once.
+GOOGLE_PS_API_WORKERS = 8
+
+# Max number of calls queued or in flight, 'submit()' blocks beyond that so that pages are not measured far ahead of
+# the API.
+GOOGLE_PS_API_MAX_PENDING = 64
+
+# Retries for rate limited (429) and server side (5xx) errors, with exponential backoff.
+GOOGLE_PS_API_MAX_RETRIES = 5
+GOOGLE_PS_API_BACKOFF_S = 2.0
+
+
+class TokenBucket:
+    """Token bucket rate limiter shared by all API calls."""
+
+
+    def __init__(self, rate, capacity):
+        # Tokens added per second.
+        self._rate = rate
+
+        # Max tokens that can be accumulated.
+        self._capacity = capacity
+
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait_s = (1 - self._tokens) / self._rate
+
+            time.sleep(wait_s)
 
 
 class GoogleInsights:
     """Manage requests to Google Page Speed Insights."""
 
 
-    def __init__(self):
-        self.last_processed = int(time.time())
+    def __init__(self, phase_timer=None, max_pending=GOOGLE_PS_API_MAX_PENDING):
+        # Records the time waiting for the rate limit and the time of each API call, see 'PhaseTimer'.
+        self._phase_timer = phase_timer or PhaseTimer()
+
+        self._bucket = TokenBucket(GOOGLE_PS_API_RATE_S, GOOGLE_PS_API_BURST)
+        self._executor = ThreadPoolExecutor(max_workers=GOOGLE_PS_API_WORKERS)
+
+        # Futures of calls not yet completed, including calls waiting to be retried.
+        self._pending = set()
+        self._pending_lock = threading.Condition()
+        self._max_pending = max_pending
+
+        # Set on shutdown, calls are no longer queued and queued calls are skipped.
+        self._closed = False
+
+
+    def share_quota(self, share_cnt):
+        """Limit the calls to a share of the API quota, for processes calling the API at the same time."""
+        self._bucket = TokenBucket(GOOGLE_PS_API_RATE_S / share_cnt, max(1, GOOGLE_PS_API_BURST // share_cnt))
 
 
     @staticmethod
@@ -46,37 +118,135 @@ class GoogleInsights:
         json.dump(res, file, indent=4)
 
 
-    def page_performance(self, url, debug=False):
-        """Call Google Page Speed Insights API"""
-        # https://developers.google.com/speed/docs/insights/v5/reference/pagespeedapi/runpagespeed
+    @staticmethod
+    def _retry_after(res, attempt):
+        """Seconds to wait before retrying, honouring the server's Retry-After header."""
+        retry_after = res.headers.get('Retry-After', '') if res is not None else ''
+        if retry_after.isdigit():
+            return float(retry_after)
+
+        return GOOGLE_PS_API_BACKOFF_S * 2 ** attempt
+
 
-        run_time_diff = int(time.time()) - self.last_processed
-        if run_time_diff < GOOGLE_PS_API_WAIT_S:
-            logging.error('Google Insights API: Waiting until call time reached: %s.', run_time_diff)
-            time.sleep(GOOGLE_PS_API_WAIT_S - run_time_diff)
+    def _call(self, url, debug, future, attempt=0):
+        """Call the API, the future is always resolved so that waiting on it cannot hang."""
+        if self._closed:
+            future.set_result(None)
+            return
 
-        self.last_processed = int(time.time())
+        try:
+            self._request(url, debug, future, attempt)
+        except Exception as ex:
+            logging.error('Google Insights API: Exception: %s, URL: %s', ex, url)
+            if not future.done():
+                future.set_result(None)
+
+
+    def _request(self, url, debug, future, attempt):
+        """Call the API and resolve the future, or schedule a retry."""
+        # https://developers.google.com/speed/docs/insights/v5/reference/pagespeedapi/runpagespeed
+        with self._phase_timer.phase(url, 'insights_wait'):
+            self._bucket.acquire()
 
         q_params = { 'url': url,
             'key': config.GOOGLE_PS_API_KEY,
-            'strategy': 'DESKTOP', # 'DESKTOP', # MOBILE
+            'strategy': GOOGLE_PS_API_STRATEGY,
             'category': ['PERFORMANCE','ACCESSIBILITY','BEST_PRACTICES','SEO'],
             'locale': 'en'
             }
 
-        res = requests.get(GOOGLE_PS_API_URL, params = q_params)
-        if res.status_code==200:
+        try:
+            with self._phase_timer.phase(url, 'insights'):
+                res = http_session.get(GOOGLE_PS_API_URL, params = q_params, timeout=GOOGLE_PS_API_TIMEOUT_S)
+            status_code = res.status_code
+        except requests.RequestException as ex:
+            logging.error('Google Insights API: Request failed, URL: %s - %s', url, ex)
+            res = None
+            status_code = None
+
+        if status_code==200:
             res = json.loads(res.text)
 
             if debug:
                 self._dump_json(url, res)
 
-        elif res.status_code==429:
-            logging.error('Google Insights API: Call limit reached.')
+            future.set_result(res)
+
+        elif (status_code is None or status_code==429 or status_code >= 500) and attempt < GOOGLE_PS_API_MAX_RETRIES:
+            delay_s = self._retry_after(res, attempt)
+            logging.warning('Google Insights API: Code: %s, retrying in %ss, URL: %s', status_code, delay_s, url)
+
+            # Deferred so that the waiting call does not hold up one of the workers.
+            timer = threading.Timer(delay_s, self._resubmit, (url, debug, future, attempt + 1))
+            timer.daemon = True
+            timer.start()
 
         else:
             logging.error('Google Insights API: Could not process request, URL: %s', url)
-            logging.error('Google Insights API: Could not process request, code: %s', res.status_code)
-            res = None
+            logging.error('Google Insights API: Could not process request, code: %s', status_code)
+            future.set_result(None)
+
+
+    def _resubmit(self, url, debug, future, attempt):
+        """Queue a retry of a failed call."""
+        try:
+            self._executor.submit(self._call, url, debug, future, attempt)
+        except RuntimeError:
+            # Shut down while waiting to retry.
+            future.set_result(None)
+
+
+    def _call_done(self, future):
+        """Stop tracking a completed call."""
+        with self._pending_lock:
+            self._pending.discard(future)
+            self._pending_lock.notify_all()
+
+
+    def submit(self, url, debug=False, callback=None):
+        """
+        Queue a call to Google Page Speed Insights, returns a future resolving to the response or None.
+
+        The optional callback is called with the future on completion, before 'wait()' returns. Blocks while
+        'max_pending' calls are pending.
+        """
+        future = Future()
+        with self._pending_lock:
+            while len(self._pending) >= self._max_pending and not self._closed:
+                self._pending_lock.wait()
+
+            self._pending.add(future)
+
+        if callback:
+            future.add_done_callback(callback)
+        future.add_done_callback(self._call_done)
+
+        try:
+            self._executor.submit(self._call, url, debug, future)
+        except RuntimeError:
+            # Shut down while waiting to queue the call.
+            future.set_result(None)
+
+        return future
+
+
+    def page_performance(self, url, debug=False):
+        """Call Google Page Speed Insights API"""
+        return self.submit(url, debug).result()
+
+
+    def wait(self):
+        """Block until all queued calls, including retries, are completed."""
+        # Calls are only removed once their callbacks have run, see '_call_done()'.
+        with self._pending_lock:
+            while self._pending:
+                self._pending_lock.wait()
+
+
+    def shutdown(self):
+        """Stop processing queued calls, these resolve to None."""
+        with self._pending_lock:
+            self._closed = True
+            self._pending_lock.notify_all()
 
-        return res
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,198 @@
+"""
+HTTP-only page measurement, without browser.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import html
+import re
+import time
+from urllib.parse import urljoin, urldefrag, urlparse
+
+import requests
+
+from .http_session import session as http_session, HTTP_TIMEOUT_S
+from .link_checker import extract_links
+from .metrics import RESOURCE_FONTS
+
+# Number of subresources of a page fetched at once.
+SUBRESOURCE_WORKERS = 8
+
+# Subresources referenced in the page HTML: stylesheets, scripts, images and preloaded fonts.
+RE_TAG = re.compile(r'<(link|script|img)\s[^>]*>', re.IGNORECASE)
+RE_ATTRIBUTE = re.compile(r'\b(rel|as|href|src)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+# Fonts referenced in stylesheets.
+RE_CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)', re.IGNORECASE)
+
+
+def _ms(seconds):
+    """Seconds as milliseconds, the unit of the browser timing API."""
+    return seconds * 1000.0
+
+
+def _tag_attributes(tag):
+    """Attributes of an HTML tag matched by 'RE_TAG', by lowercase name."""
+    return {
+        match.group(1).lower(): html.unescape(next(group for group in match.groups()[1:] if group is not None))
+        for match in RE_ATTRIBUTE.finditer(tag)
+    }
+
+
+def extract_subresources(page_url, content):
+    """List of (url, initiator type) tuples of the stylesheets, scripts, images and fonts referenced in a page."""
+    subresources = {}
+    for tag in RE_TAG.finditer(content):
+        attributes = _tag_attributes(tag.group(0))
+
+        tag_name = tag.group(1).lower()
+        if tag_name == 'link':
+            rel = attributes.get('rel', '').lower().split()
+            if 'stylesheet' in rel:
+                initiator_type, url = 'css', attributes.get('href')
+            elif 'preload' in rel and attributes.get('as', '').lower() == 'font':
+                initiator_type, url = 'font', attributes.get('href')
+            else:
+                continue
+
+        elif tag_name == 'script':
+            initiator_type, url = 'script', attributes.get('src')
+
+        else:
+            initiator_type, url = 'img', attributes.get('src')
+
+        if url and not url.startswith('data:'):
+            url = urldefrag(urljoin(page_url, url.strip()))[0]
+            if urlparse(url).scheme in ('http', 'https'):
+                subresources.setdefault(url, initiator_type)
+
+    return list(subresources.items())
+
+
+def extract_canonical(response, content=''):
+    """Canonical URL declared by a page, in its 'Link' response header or in the HTML, or None."""
+    canonical_url = response.links.get('canonical', {}).get('url')
+
+    if not canonical_url:
+        for tag in RE_TAG.finditer(content):
+            attributes = _tag_attributes(tag.group(0))
+            if tag.group(1).lower() == 'link' and 'canonical' in attributes.get('rel', '').lower().split():
+                canonical_url = attributes.get('href')
+                break
+
+    return urljoin(response.url, canonical_url.strip()) if canonical_url else None
+
+
+def extract_fonts(css_url, content):
+    """URLs of the fonts referenced in a stylesheet."""
+    fonts = []
+    for match in RE_CSS_URL.finditer(content):
+        url = urldefrag(urljoin(css_url, match.group(1).strip()))[0]
+        if urlparse(url).path.endswith(tuple(RESOURCE_FONTS)):
+            fonts.append(url)
+
+    return fonts
+
+
+class HttpEngine:
+    """
+    Measure pages with plain HTTP requests, a fast alternative to the browser for large sweeps.
+
+    'measure()' returns the same page snapshot as the browser page metrics script, so that results share the column
+    schema of browser measurements. As no page is rendered, DOM timings mark the end of the subresource downloads.
+    """
+
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=SUBRESOURCE_WORKERS)
+
+        # Set on quit, queued subresource downloads are skipped.
+        self._closed = False
+
+
+    @staticmethod
+    def _fetch(url):
+        """Download a single subresource, returns its resource timing entry and the response."""
+        start = time.perf_counter()
+        try:
+            response = http_session.get(url, timeout=HTTP_TIMEOUT_S)
+        except requests.RequestException:
+            return None, None
+
+        duration = time.perf_counter() - start
+        size = int(response.headers.get('Content-Length') or len(response.content))
+
+        return {'name': url, 'duration': _ms(duration), 'encodedBodySize': size}, response
+
+
+    def _fetch_subresource(self, url, initiator_type):
+        """Download a subresource, stylesheets are followed by the fonts they reference."""
+        if self._closed:
+            return []
+
+        entry, response = self._fetch(url)
+        if not entry:
+            return []
+
+        entry['initiatorType'] = initiator_type
+        entries = [entry]
+
+        if initiator_type == 'css' and response.status_code == 200:
+            for font_url in extract_fonts(url, response.text):
+                font_entry, _ = self._fetch(font_url)
+                if font_entry:
+                    font_entry['initiatorType'] = 'font'
+                    entries.append(font_entry)
+
+        return entries
+
+
+    def measure(self, url):
+        """Download a page and its subresources, raises 'requests.RequestException' if the page cannot be reached."""
+        start = time.perf_counter()
+        response = http_session.get(url, stream=True, timeout=HTTP_TIMEOUT_S)
+
+        with response:
+            # 'elapsed' is measured up to the response headers of each request.
+            redirected = sum(redirect.elapsed.total_seconds() for redirect in response.history)
+            response_start = redirected + response.elapsed.total_seconds()
+
+            content = response.text
+            response_end = time.perf_counter() - start
+
+        metrics = {
+            'status': response.status_code,
+            'links': [],
+            'resource': [],
+            'finalUrl': response.url,
+            'canonicalUrl': extract_canonical(response, content)
+        }
+
+        if response.status_code == 200 and 'html' in response.headers.get('Content-Type', 'text/html'):
+            metrics['links'] = extract_links(response.url, content)
+
+            futures = [
+                self._executor.submit(self._fetch_subresource, subresource_url, initiator_type)
+                for subresource_url, initiator_type in extract_subresources(response.url, content)
+            ]
+            for future in futures:
+                metrics['resource'].extend(future.result())
+
+        complete = time.perf_counter() - start
+
+        metrics['pageTiming'] = {
+            'navigationStart': 0,
+            'redirectStart': 0,
+            'redirectEnd': _ms(redirected),
+            'responseStart': _ms(response_start),
+            'responseEnd': _ms(response_end),
+            'domLoading': _ms(response_end),
+            'domInteractive': _ms(response_end),
+            'domComplete': _ms(complete)
+        }
+
+        return metrics
+
+
+    def quit(self):
+        """Stop the subresource downloads, mirrors the browser interface."""
+        self._closed = True
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,24 @@
+"""
+Shared HTTP session for all requests made outside the browser.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept alive per host, should cover the number of threads making requests.
+HTTP_POOL_SIZE = 32
+
+HTTP_TIMEOUT_S = 30
+
+
+def create_session(pool_size=HTTP_POOL_SIZE):
+    """Create a keep-alive session with a connection pool shared by all threads."""
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+session = create_session()
@@ -0,0 +1,90 @@
+"""
+Google PageSpeed Insights results cache.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = 'var/insights_cache.sqlite3'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS insights (
+        url TEXT, strategy TEXT, validator TEXT, created REAL, insights TEXT, PRIMARY KEY (url, strategy)
+    );
+"""
+
+
+class InsightsCache:
+    """Keep reduced Insights results on disk, by URL and strategy, so that unchanged pages are not analysed again."""
+
+
+    def __init__(self):
+        self._connection = None
+        self._lock = threading.Lock()
+
+        # Max age of cached results, the cache is disabled if 0.
+        self._ttl_s = 0
+
+
+    def open(self, ttl_s, path=CACHE_PATH):
+        """Open the cache, results older than 'ttl_s' seconds are ignored."""
+        self._ttl_s = ttl_s
+        if ttl_s <= 0:
+            return
+
+        dir_path = os.path.dirname(path)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        # Results arrive on the Insights API threads, access is serialised on the cache lock.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+
+    def get(self, url, strategy, validator=None):
+        """
+        Cached results of a page, or None.
+
+        The validator identifies the page version - e.g. its ETag - results cached for another version are ignored.
+        Without a validator only the age of the results is checked.
+        """
+        if not self._connection:
+            return None
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT validator, created, insights FROM insights WHERE url = ? AND strategy = ?', (url, strategy)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        cached_validator, created, insights = row
+        if time.time() - created > self._ttl_s:
+            return None
+
+        if validator and cached_validator != validator:
+            return None
+
+        return json.loads(insights)
+
+
+    def put(self, url, strategy, validator, insights):
+        """Cache the results of a page."""
+        if not self._connection:
+            return
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO insights VALUES (?, ?, ?, ?, ?)',
+                (url, strategy, validator, time.time(), json.dumps(insights))
+            )
+
+
+    def close(self):
+        """Close the cache."""
+        if self._connection:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,168 @@
+"""
+Browser-free link checker.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import html
+import logging
+import re
+import threading
+from urllib.parse import urljoin, urldefrag, urlparse
+
+import requests
+
+from .http_session import session as http_session, HTTP_TIMEOUT_S
+
+# Number of pages and links checked at once, see 'http_session.HTTP_POOL_SIZE'.
+LINK_CHECK_WORKERS = 32
+
+# Max number of requests to a single host at once.
+HOST_CONNECTIONS = 8
+
+# Link and base URLs of a page, matched on the raw HTML rather than parsing the document.
+RE_LINK = re.compile(r'<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+RE_BASE = re.compile(r'<base\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+
+def extract_links(page_url, content):
+    """Absolute HTTP(S) URLs of all links in a page, without fragments and duplicates."""
+    base = RE_BASE.search(content)
+    if base:
+        page_url = urljoin(page_url, html.unescape(next(group for group in base.groups() if group is not None)))
+
+    links = {}
+    for match in RE_LINK.finditer(content):
+        href = html.unescape(next(group for group in match.groups() if group is not None)).strip()
+        url = urldefrag(urljoin(page_url, href))[0]
+        if urlparse(url).scheme in ('http', 'https'):
+            links[url] = True
+
+    return list(links)
+
+
+class LinkChecker:
+    """Crawl a website without browser, checking the status of every internal and external link found."""
+
+
+    def __init__(self, url_mgmt, follow_links=True):
+        # Shared URL frontier.
+        self._url_mgmt = url_mgmt
+
+        # Internal links are added to the frontier if set, otherwise only their status is checked.
+        self._follow_links = follow_links
+
+        self._executor = ThreadPoolExecutor(max_workers=LINK_CHECK_WORKERS)
+
+        # Guards the registries below.
+        self._lock = threading.Lock()
+
+        # Links submitted for a status check.
+        self._checked = set()
+        self._pending = []
+
+        # Request slots per host.
+        self._host_slots = {}
+
+
+    def _host_slot(self, url):
+        """Semaphore limiting the number of concurrent requests to the host of a URL."""
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if not slot:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(HOST_CONNECTIONS)
+
+        return slot
+
+
+    def _status(self, url):
+        """Status code of a URL, the body is only downloaded if the server does not handle HEAD requests."""
+        with self._host_slot(url):
+            request = http_session.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT_S)
+
+            # Not all servers support HEAD requests, some refuse them with other error codes.
+            if request.status_code < 400:
+                return request.status_code
+
+            # The connection is closed without downloading the body.
+            with http_session.get(url, stream=True, timeout=HTTP_TIMEOUT_S) as request:
+                return request.status_code
+
+
+    def _check_link(self, url, internal):
+        """Check a single link, internal links that cannot be reached are reported as unreachable pages."""
+        try:
+            status_code = self._status(url)
+        except requests.RequestException as ex:
+            status_code = ex
+
+        if internal:
+            if status_code != 200:
+                self._url_mgmt.unreachable_pages(url, status_code)
+                logging.error('Error loading: %s - status: %s', url, status_code)
+        else:
+            self._url_mgmt.external_pages(url, 0, status_code)
+
+
+    def _submit_link(self, url, internal):
+        """Check the status of a link in the background, each link is checked once."""
+        with self._lock:
+            if url in self._checked:
+                return
+
+            self._checked.add(url)
+            self._pending.append(self._executor.submit(self._check_link, url, internal))
+
+
+    def check_page(self, _, url):
+        """Download a page of the website and check its links, see 'WorkerPool' - no browser instance is used."""
+        logging.info('Processing: %s', url)
+
+        try:
+            with self._host_slot(url):
+                request = http_session.get(url, timeout=HTTP_TIMEOUT_S)
+        except requests.RequestException as ex:
+            self._url_mgmt.unreachable_pages(url, ex)
+            logging.error('Error loading: %s - status: %s', url, ex)
+            return
+
+        if request.status_code != 200:
+            self._url_mgmt.unreachable_pages(url, request.status_code)
+            logging.error('Error loading: %s - status: %s', url, request.status_code)
+            return
+
+        self._url_mgmt.processed_pages(url)
+
+        if 'html' not in request.headers.get('Content-Type', 'text/html'):
+            return
+
+        depth = self._url_mgmt.page_depth(url) + 1
+        for link in extract_links(request.url, request.text):
+            if not self._url_mgmt.is_internal(link):
+                self._url_mgmt.external_pages(link)
+                self._submit_link(link, False)
+
+            # Links owned by other shards are sent to them, to be checked once - see 'check_sent_links()'.
+            elif self._follow_links or not self._url_mgmt.in_shard(link):
+                self._url_mgmt.unprocessed_pages(link, depth=depth)
+
+            else:
+                self._submit_link(link, True)
+
+
+    def check_sent_links(self, urls):
+        """
+        Check the status of the internal links sent by other shards when links are not followed, see 'Shard.inbox()'.
+
+        A URL source adding nothing to the frontier.
+        """
+        for url in urls:
+            self._submit_link(url, True)
+
+        yield from ()
+
+
+    def wait(self):
+        """Wait for all link checks to complete."""
+        self._executor.shutdown(wait=True)
+        for future in self._pending:
+            future.result()
@@ -13,6 +13,16 @@ RESOURCE_FONTS = ['otf', 'ttf', 'eot', 'woff', 'woff2']
 RESOURCE_IMAGES = ['.apng', '.avif', '.gif', '.jpg', '.jpeg', '.jfif', '.pjpeg', '.pjp', '.png', '.svg', '.webp',
                    '.bmp', '.ico', '.cur', '.tif', '.tiff']
 
+# Audit fields used in the audit reports.
+AUDIT_FIELDS = ['id', 'title', 'displayValue', 'overallSavingsMs', 'description']
+
+# Resource classification rules passed to the page metrics script when resources are aggregated in the browser.
+RESOURCE_RULES = {
+    'initiatorTypes': INITIATORTYPES,
+    'fonts': RESOURCE_FONTS,
+    'images': RESOURCE_IMAGES
+}
+
 
 def fmt(m_val):
     """Format metric values based on type."""
@@ -57,16 +67,19 @@ def process_insights_metrics(insights_metrics):
     return metrics
 
 
-def _process_audit_item(url, audit_item, url_mgmt):
+def _process_audit_item(audit_item, findings):
     """Process the identified item."""
     details = audit_item.get('details')
     if details:
-        for item in details['items']:
-            url_mgmt.audit_results(url, audit_item, item)
+        item = {key: audit_item[key] for key in AUDIT_FIELDS if key in audit_item}
+        for detail in details['items']:
+            findings.append((item, detail))
+
 
+def process_audit(insights_metrics):
+    """Identify areas of improvement, returns a list of (audit item, detail item) tuples."""
+    findings = []
 
-def process_audit(url, insights_metrics, url_mgmt):
-    """Identify areas of improvement."""
     i_audits = insights_metrics["lighthouseResult"]["audits"]
     for key in i_audits:
         audit_item = i_audits[key]
@@ -74,18 +87,36 @@ def process_audit(url, insights_metrics, url_mgmt):
             continue
 
         if audit_item['scoreDisplayMode'] == 'binary' and audit_item['score'] == 0:
-            _process_audit_item(url, audit_item, url_mgmt)
+            _process_audit_item(audit_item, findings)
 
         elif audit_item['scoreDisplayMode'] == 'binary' and audit_item['score'] <= 0.8:
-            _process_audit_item(url, audit_item, url_mgmt)
+            _process_audit_item(audit_item, findings)
 
         elif audit_item['scoreDisplayMode'] == 'numeric' and audit_item['score'] <= 0.8:
-            _process_audit_item(url, audit_item, url_mgmt)
+            _process_audit_item(audit_item, findings)
 
         # elif audit_item['scoreDisplayMode'] == 'binary' and audit_item['score'] <= 0.8:
-        #     _process_audit_item(url, audit_item, url_mgmt)
+        #     _process_audit_item(audit_item, findings)
         # elif key == 'render-blocking-resources' and audit_item['score'] < 0.8:
-        #     _process_audit_item(url, audit_item, url_mgmt)
+        #     _process_audit_item(audit_item, findings)
+
+    return findings
+
+
+def reduce_insights(insights_metrics):
+    """Reduce an Insights API response to the metrics and audit findings used in the reports."""
+    return {
+        'metrics': process_insights_metrics(insights_metrics),
+        'audits': process_audit(insights_metrics)
+    }
+
+
+def _timing(page_timing, start, end):
+    """Time between two page timing marks, None if the page was measured before the end mark was reached."""
+    if not page_timing[end]:
+        return None
+
+    return fmt((page_timing[end] - page_timing[start]) / MILLISECONDS)
 
 
 def process_timing_metrics(timing_metrics):
@@ -95,19 +126,19 @@ def process_timing_metrics(timing_metrics):
     page_timing = timing_metrics['pageTiming']
 
     metrics['server'] = fmt((page_timing['responseStart'] - page_timing['navigationStart']) / MILLISECONDS)
-    metrics['browser'] = fmt((page_timing['domComplete'] - page_timing['responseStart']) / MILLISECONDS)
-    metrics['usable'] = fmt((page_timing['domInteractive'] - page_timing['navigationStart']) / MILLISECONDS)
-    metrics['total'] = fmt((page_timing['domComplete'] - page_timing['navigationStart']) / MILLISECONDS)
+    metrics['browser'] = _timing(page_timing, 'responseStart', 'domComplete')
+    metrics['usable'] = _timing(page_timing, 'navigationStart', 'domInteractive')
+    metrics['total'] = _timing(page_timing, 'navigationStart', 'domComplete')
     metrics['data_transfer'] = fmt((page_timing['responseEnd'] - page_timing['responseStart']) / MILLISECONDS)
     metrics['redirected'] = fmt((page_timing['redirectEnd'] - page_timing['redirectStart']) / MILLISECONDS)
-    metrics['dom'] = fmt((page_timing['domComplete'] - page_timing['domLoading']) / MILLISECONDS)
+    metrics['dom'] = _timing(page_timing, 'domLoading', 'domComplete')
 
     return metrics
 
 
-def process_page_resources(source_url, timing_metrics, url_mgmt):
-    """Create a dictionary with resource usage."""
-    metrics = {
+def _empty_resource_metrics():
+    """Resource usage metrics with all counters set to zero."""
+    return {
         'img': 0,
         'img_sec': 0,
         'img_size': 0,
@@ -137,12 +168,38 @@ def process_page_resources(source_url, timing_metrics, url_mgmt):
         'other_size': 0
     }
 
+
+def process_page_resource_summary(source_url, timing_metrics, url_mgmt):
+    """Create a dictionary with resource usage already aggregated in the browser, see 'RESOURCE_RULES'."""
+    metrics = _empty_resource_metrics()
+
+    for i_type, summary in timing_metrics['resourceSummary'].items():
+        metrics[i_type] = summary['cnt']
+        metrics[i_type + '_sec'] = fmt(summary['duration'] / MILLISECONDS)
+        metrics[i_type + '_size'] = fmt(summary['size'] / BYTE_TO_KILOBYTE)
+
+    url_mgmt.add_page_resources(source_url, [
+        (resource_url, i_type, cnt, size / BYTE_TO_KILOBYTE, duration / MILLISECONDS)
+        for resource_url, i_type, cnt, size, duration in timing_metrics['resourceUrls']
+    ])
+
+    return metrics
+
+
+def process_page_resources(source_url, timing_metrics, url_mgmt):
+    """Create a dictionary with resource usage."""
+    if 'resourceSummary' in timing_metrics:
+        return process_page_resource_summary(source_url, timing_metrics, url_mgmt)
+
+    metrics = _empty_resource_metrics()
+
     # PerformanceEntry Types: https://developer.mozilla.org/en-US/docs/Web/API/PerformanceEntry/entryType
     # Using the Resource Timing API:
     # https://developer.mozilla.org/en-US/docs/Web/API/Resource_Timing_API/Using_the_Resource_Timing_API
 
     # PerformanceResourceTiming: https://developer.mozilla.org/en-US/docs/Web/API/PerformanceResourceTiming
     resources = timing_metrics['resource']
+    resource_references = []
     for resource in resources:
         i_type = resource['initiatorType'].lower()
         if i_type not in INITIATORTYPES:
@@ -168,20 +225,26 @@ def process_page_resources(source_url, timing_metrics, url_mgmt):
         metrics[i_type + '_sec'] = fmt(metrics[i_type + '_sec'] + (resource['duration'] / MILLISECONDS))
         metrics[i_type + '_size'] = fmt(metrics[i_type + '_size'] + (resource['encodedBodySize'] / BYTE_TO_KILOBYTE))
 
-        url_mgmt.processed_resource_references(source_url, resource['name'], i_type)
+        resource_references.append(
+            (resource['name'], i_type, 1, resource['encodedBodySize'] / BYTE_TO_KILOBYTE,
+             resource['duration'] / MILLISECONDS)
+        )
+
+    url_mgmt.add_page_resources(source_url, resource_references)
 
     return metrics
 
 
-def process_page_metrics(source_url, timing_metrics, insights_metrics, url_mgmt):
+def process_page_metrics(source_url, timing_metrics, insights, url_mgmt):
     """Report on page statistics."""
 
     metrics = {}
 
-    # Google Page Speed Insights.
-    if insights_metrics:
-        metrics = process_insights_metrics(insights_metrics)
-        process_audit(source_url, insights_metrics, url_mgmt)
+    # Google Page Speed Insights, see 'reduce_insights()'.
+    if insights:
+        metrics = dict(insights['metrics'])
+        for audit_item, detail in insights['audits']:
+            url_mgmt.audit_results(source_url, audit_item, detail)
 
     # Page Timing Metrics.
     if timing_metrics:
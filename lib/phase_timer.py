@@ -0,0 +1,104 @@
+"""
+Per page phase timings.
+"""
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import numpy as np
+
+# Prometheus metric name, see 'PhaseTimer.write_prometheus()'.
+PROMETHEUS_METRIC = 'site_crawler_phase_seconds'
+
+PROMETHEUS_QUANTILES = [0.5, 0.95]
+
+
+class PhaseTimer:
+    """Record how long each phase of processing a page takes."""
+
+    # Phase timing CSV output columns, one row per page and phase.
+    COLUMNS_PHASES = ['url', 'phase', 'sec']
+
+    # Phase summary CSV output columns.
+    COLUMNS_SUMMARY = ['phase', 'cnt', 'total_sec', 'p50_sec', 'p95_sec', 'max_sec']
+
+
+    def __init__(self):
+        # (url, phase, seconds) tuples in order of completion.
+        self._timings = []
+        self._lock = threading.Lock()
+
+
+    def record(self, url, phase, seconds):
+        """Register the duration of a phase."""
+        with self._lock:
+            self._timings.append((url, phase, seconds))
+
+
+    @contextmanager
+    def phase(self, url, phase):
+        """Time the enclosed block as a phase of the page."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(url, phase, time.perf_counter() - start)
+
+
+    def timings(self):
+        """List of all phase timings."""
+        with self._lock:
+            return [{'url': url, 'phase': phase, 'sec': round(seconds, 4)} for url, phase, seconds in self._timings]
+
+
+    def _durations(self):
+        """Array of durations by phase, in order of first occurrence."""
+        durations = {}
+        with self._lock:
+            for _, phase, seconds in self._timings:
+                durations.setdefault(phase, []).append(seconds)
+
+        return {phase: np.array(values) for phase, values in durations.items()}
+
+
+    def summary(self):
+        """Count, total, median, 95th percentile and max duration of each phase."""
+        return [
+            {
+                'phase': phase,
+                'cnt': len(values),
+                'total_sec': round(values.sum(), 2),
+                'p50_sec': round(np.percentile(values, 50), 3),
+                'p95_sec': round(np.percentile(values, 95), 3),
+                'max_sec': round(values.max(), 3)
+            }
+            for phase, values in self._durations().items()
+        ]
+
+
+    def write_prometheus(self, path):
+        """Write the phase durations as a Prometheus summary, for the node exporter textfile collector."""
+        lines = [
+            '# HELP {} Duration of the phases of processing a page.'.format(PROMETHEUS_METRIC),
+            '# TYPE {} summary'.format(PROMETHEUS_METRIC)
+        ]
+        for phase, values in self._durations().items():
+            for quantile in PROMETHEUS_QUANTILES:
+                lines.append('{}{{phase="{}",quantile="{}"}} {}'.format(
+                    PROMETHEUS_METRIC, phase, quantile, np.percentile(values, quantile * 100)
+                ))
+
+            lines.append('{}_sum{{phase="{}"}} {}'.format(PROMETHEUS_METRIC, phase, values.sum()))
+            lines.append('{}_count{{phase="{}"}} {}'.format(PROMETHEUS_METRIC, phase, len(values)))
+
+        dir_path = os.path.dirname(path)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        # The collector must never read a partially written file.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+        os.replace(temp_path, path)
@@ -0,0 +1,51 @@
+"""
+Profiling of a complete run.
+"""
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+
+
+class RunProfiler:
+    """cProfile the main thread and every thread started while profiling, the statistics of all threads are merged."""
+
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._thread_profiles = []
+        self._lock = threading.Lock()
+
+
+    def _profile_thread(self, *_):
+        """Profile hook of new threads, replaced by a profiler of the thread on its first call."""
+        sys.setprofile(None)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Only one profiler can be active at a time as of Python 3.12.
+            return
+
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+
+    def start(self):
+        """Start profiling."""
+        threading.setprofile(self._profile_thread)
+        self._profile.enable()
+
+
+    def stop(self, path):
+        """Stop profiling and save the statistics, see the 'pstats' module."""
+        self._profile.disable()
+        threading.setprofile(None)
+
+        with self._lock:
+            stats = pstats.Stats(self._profile, *self._thread_profiles)
+
+        stats.dump_stats(path)
+        logging.warning('Profile: %s threads profiled, statistics saved to: %s', len(self._thread_profiles) + 1, path)
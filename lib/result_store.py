@@ -0,0 +1,77 @@
+"""
+Column store for page results.
+"""
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Rows allocated up front, capacity doubles when full.
+INITIAL_CAPACITY = 1024
+
+
+class ResultStore:
+    """Append-only table of page results, numeric columns are kept in preallocated float arrays."""
+
+
+    def __init__(self, columns, text_columns):
+        self._columns = list(columns)
+        self._text_columns = set(text_columns)
+
+        self._numeric = {column: np.full(INITIAL_CAPACITY, np.nan) for column in columns if column not in text_columns}
+        self._text = {column: [] for column in columns if column in text_columns}
+
+        self._capacity = INITIAL_CAPACITY
+        self._len = 0
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return self._len
+
+
+    def _grow(self):
+        """Double the capacity of the numeric columns."""
+        self._capacity *= 2
+        for column, values in self._numeric.items():
+            grown = np.full(self._capacity, np.nan)
+            grown[:self._len] = values[:self._len]
+            self._numeric[column] = grown
+
+
+    def append(self, row):
+        """Add a row, missing values are stored as NaN or None."""
+        with self._lock:
+            if self._len == self._capacity:
+                self._grow()
+
+            for column, values in self._numeric.items():
+                value = row.get(column)
+                if value is not None:
+                    values[self._len] = value
+
+            for column, values in self._text.items():
+                value = row.get(column)
+                # Groupings repeat across pages, interning keeps a single copy of each string.
+                values.append(sys.intern(value) if isinstance(value, str) else value)
+
+            self._len += 1
+
+
+    def data_frame(self):
+        """
+        DataFrame of all rows, built once per report.
+
+        The stored arrays are passed without copying, but pandas consolidates the numeric columns into a single block,
+        a copy the size of the numeric results.
+        """
+        with self._lock:
+            data = {}
+            for column in self._columns:
+                if column in self._text_columns:
+                    data[column] = self._text[column]
+                else:
+                    data[column] = self._numeric[column][:self._len]
+
+            return pd.DataFrame(data, columns=self._columns)
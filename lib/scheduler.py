@@ -0,0 +1,173 @@
+"""
+Crawl frontier schedulers.
+"""
+from collections import OrderedDict
+import heapq
+import itertools
+
+SCHEDULER_FIFO = 'fifo'
+SCHEDULER_PRIORITY = 'priority'
+SCHEDULERS = [SCHEDULER_FIFO, SCHEDULER_PRIORITY]
+
+# Heap entries removed from the frontier are dropped once they outnumber the queued URLs by this factor.
+COMPACT_FACTOR = 2
+
+
+class FifoScheduler:
+    """Hand out URLs in the order they were found."""
+
+
+    def __init__(self):
+        # Used as an ordered set.
+        self._urls = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._urls)
+
+
+    def __contains__(self, url):
+        return url in self._urls
+
+
+    def add(self, url, depth=0):
+        """Queue a URL, 'depth' is its number of links from the start URLs."""
+        self._urls[url] = depth
+
+
+    def pop(self):
+        """Remove and return the next URL, or None if empty."""
+        if not self._urls:
+            return None
+
+        url, _ = self._urls.popitem(last=False)
+        return url
+
+
+    def remove(self, url):
+        """Remove a queued URL, returns False if it was not queued."""
+        return self._urls.pop(url, None) is not None
+
+
+    def urls(self, clone=True):
+        """Queued URLs, or a live read-only view of them if not cloned."""
+        return list(self._urls) if clone else self._urls.keys()
+
+
+class PriorityScheduler:
+    """
+    Hand out the most valuable URLs first, so that a limited crawl covers the website best.
+
+    URLs are queued by grouping, see 'config.DF_GROUP_BY'. The next URL comes from the grouping furthest below its
+    quota - its share of the URLs handed out so far, by weight. Groupings without weight are only served once the
+    others are empty. Without quotas all groupings share a single queue. Within a grouping, URLs closest to the start
+    URLs come first, then the ones measured longest ago, pages never measured before first.
+    """
+
+
+    def __init__(self, grouping=None, quotas=None, last_measured=None):
+        # Callable returning the grouping of a URL.
+        self._grouping = grouping if quotas else None
+
+        # Weight of each grouping.
+        self._quotas = quotas or {}
+
+        # Time each page was last measured, by URL - a sortable string, see the 'time' page result.
+        self._last_measured = last_measured or {}
+
+        # Heap of (depth, last measured, sequence, url) entries by grouping, entries of removed URLs are left in place.
+        self._heaps = {}
+
+        # Number of URLs handed out by grouping.
+        self._served = {}
+
+        # Grouping of each queued URL.
+        self._queued = {}
+
+        self._heap_len = 0
+        self._sequence = itertools.count()
+
+
+    def __len__(self):
+        return len(self._queued)
+
+
+    def __contains__(self, url):
+        return url in self._queued
+
+
+    def add(self, url, depth=0):
+        """Queue a URL, 'depth' is its number of links from the start URLs."""
+        if url in self._queued:
+            return
+
+        grouping = self._grouping(url) if self._grouping else None
+        self._queued[url] = grouping
+
+        heapq.heappush(
+            self._heaps.setdefault(grouping, []), (depth, self._last_measured.get(url, ''), next(self._sequence), url)
+        )
+        self._heap_len += 1
+
+
+    def _next_grouping(self):
+        """Grouping to serve next, None if all are empty."""
+        next_grouping, next_share = None, None
+        for grouping, heap in self._heaps.items():
+            if not heap:
+                continue
+
+            weight = self._quotas.get(grouping, 0)
+            share = (self._served.get(grouping, 0) / weight) if weight else float('inf')
+            if next_share is None or share < next_share:
+                next_grouping, next_share = grouping, share
+
+        return next_grouping
+
+
+    def pop(self):
+        """Remove and return the next URL, or None if empty."""
+        while self._queued:
+            grouping = self._next_grouping()
+            heap = self._heaps[grouping]
+
+            _, _, _, url = heapq.heappop(heap)
+            self._heap_len -= 1
+
+            # Skip entries of removed URLs.
+            if self._queued.get(url, False) != grouping:
+                continue
+
+            del self._queued[url]
+            self._served[grouping] = self._served.get(grouping, 0) + 1
+
+            return url
+
+        return None
+
+
+    def remove(self, url):
+        """Remove a queued URL, returns False if it was not queued."""
+        if url not in self._queued:
+            return False
+
+        del self._queued[url]
+
+        if self._heap_len > COMPACT_FACTOR * len(self._queued) + 1024:
+            self._compact()
+
+        return True
+
+
+    def _compact(self):
+        """Drop the heap entries of removed URLs."""
+        for grouping, heap in self._heaps.items():
+            heap[:] = [entry for entry in heap if self._queued.get(entry[3], False) == grouping]
+            heapq.heapify(heap)
+
+        self._heap_len = sum(len(heap) for heap in self._heaps.values())
+
+
+    def urls(self, clone=True):
+        """Queued URLs in the order they were found, or a live read-only view of them if not cloned."""
+        return list(self._queued) if clone else self._queued.keys()
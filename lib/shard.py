@@ -0,0 +1,186 @@
+"""
+Sharded crawls over several processes or nodes.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+# Interval between reads of the inbox of a shard while there is nothing to process.
+SHARD_POLL_S = 0.5
+
+
+def shard_of(key, shard_cnt):
+    """Shard owning a shard key - a normalised URL or URL template - the same in every process and run."""
+    return zlib.crc32(key.encode('utf-8')) % shard_cnt
+
+
+def shards_dir(domain_name):
+    """Directory shared by the shards of a crawl, nodes must share it."""
+    return 'var/{}/shards/'.format(domain_name)
+
+
+def shard_dir(domain_name, index):
+    """Data directory of a shard: its crawl state and reports."""
+    return '{}{}/'.format(shards_dir(domain_name), index)
+
+
+class Shard:
+    """
+    One of several crawl processes sharing the pages of a website by hash of the URL, or of the URL template when
+    templates are sampled, see 'UrlManagement.shard_key()'.
+
+    Internal links owned by another shard are appended to the inbox file of that shard, in the shared directory. Each
+    shard publishes its status - idle or not, and how far its inbox was read - so that all shards can tell when the
+    crawl is complete.
+    """
+
+
+    def __init__(self, dir_path, index, shard_cnt):
+        self.index = index
+        self.shard_cnt = shard_cnt
+        self._dir_path = dir_path
+        self._lock = threading.Lock()
+
+        # Open inbox files of the other shards, by shard index.
+        self._outboxes = {}
+
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+
+        # Links can be sent before this shard starts, the inbox is never truncated.
+        open(self._inbox_path(index), 'ab').close()
+        self._write_status(False, 0)
+
+
+    def _inbox_path(self, index):
+        return os.path.join(self._dir_path, 'links_{}.txt'.format(index))
+
+
+    def _status_path(self, index):
+        return os.path.join(self._dir_path, 'status_{}.json'.format(index))
+
+
+    def owns(self, key):
+        """Check if the pages of a shard key are processed by this shard."""
+        return shard_of(key, self.shard_cnt) == self.index
+
+
+    def send(self, url, key):
+        """Hand a normalised URL to the shard owning its shard key."""
+        index = shard_of(key, self.shard_cnt)
+        with self._lock:
+            outbox = self._outboxes.get(index)
+            if not outbox:
+                outbox = self._outboxes[index] = open(self._inbox_path(index), 'ab', buffering=0)
+
+            # A single append per line, lines of concurrent writers do not interleave.
+            outbox.write((url + '\n').encode('utf-8'))
+
+
+    def _write_status(self, idle, offset):
+        """Publish the status of this shard, written atomically as it is read by the other shards."""
+        path = self._status_path(self.index)
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'idle': idle, 'offset': offset}, file)
+
+        os.replace(path + '.tmp', path)
+
+
+    def _snapshot(self):
+        """
+        Inbox size and read offset of all shards if all of them are idle and have read their whole inbox, else None.
+        """
+        snapshot = []
+        for index in range(self.shard_cnt):
+            try:
+                with open(self._status_path(index)) as file:
+                    status = json.load(file)
+
+                size = os.path.getsize(self._inbox_path(index))
+            except (OSError, ValueError):
+                return None
+
+            if not status['idle'] or status['offset'] != size:
+                return None
+
+            snapshot.append(size)
+
+        return snapshot
+
+
+    def inbox(self, pool):
+        """
+        Yield the URLs sent to this shard until the crawl of all shards is complete, see 'WorkerPool.idle()'.
+
+        Shards only send links while busy, and only become busy by reading their inbox. The crawl is complete once two
+        consecutive snapshots of all shards are the same, with every shard idle and its inbox read.
+        """
+        previous = None
+        with open(self._inbox_path(self.index), 'rb') as file:
+            while not pool.stopped:
+                line = file.readline()
+                if line.endswith(b'\n'):
+                    previous = None
+                    yield line.decode('utf-8').strip()
+                    continue
+
+                # Line still being written, read again once complete.
+                file.seek(-len(line), os.SEEK_CUR)
+
+                idle = pool.idle()
+                self._write_status(idle, file.tell())
+
+                snapshot = self._snapshot() if idle else None
+                if snapshot and snapshot == previous:
+                    return
+
+                previous = snapshot
+                time.sleep(SHARD_POLL_S)
+
+
+    def close(self):
+        """Close the inbox files of the other shards."""
+        with self._lock:
+            for outbox in self._outboxes.values():
+                outbox.close()
+
+            self._outboxes = {}
+
+
+def run_shards(domain_name, shard_cnt, resume=False):
+    """
+    Run a crawl as 'shard_cnt' processes, each started with the command-line arguments of this process and its shard
+    index. Returns True if all shards completed.
+
+    The links exchanged by a previous crawl are only kept to resume it, the output of each shard goes to 'crawl.log'
+    in its data directory.
+    """
+    dir_path = shards_dir(domain_name)
+    if os.path.exists(dir_path):
+        for file_name in os.listdir(dir_path):
+            if file_name.startswith('status_') or (not resume and file_name.startswith('links_')):
+                os.remove(os.path.join(dir_path, file_name))
+
+    processes = []
+    for index in range(shard_cnt):
+        log_dir = shard_dir(domain_name, index)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        with open(os.path.join(log_dir, 'crawl.log'), 'w') as log:
+            processes.append(subprocess.Popen(
+                [sys.executable] + sys.argv + ['--shard_index', str(index)], stdout=log, stderr=subprocess.STDOUT
+            ))
+
+    logging.warning('Shards: %s processes started, output in: %s<shard>/crawl.log', shard_cnt, dir_path)
+
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        logging.error('Shards: Shards %s failed.', failed)
+
+    return not failed
@@ -0,0 +1,141 @@
+"""
+Streaming sitemap reader.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as futures_wait
+import gzip
+import logging
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+import requests
+from usp.tree import sitemap_tree_for_homepage as site_map_tree
+
+from .http_session import session as http_session
+
+# Number of sitemaps fetched at once.
+SITEMAP_WORKERS = 8
+
+SITEMAP_TIMEOUT_S = 30
+
+# Sitemap locations checked in addition to the ones listed in robots.txt.
+SITEMAP_PATHS = ['sitemap.xml', 'sitemap_index.xml']
+
+# Page listed in a sitemap, 'last_modified' is the ISO formatted <lastmod> value or None.
+SitemapPage = namedtuple('SitemapPage', ['url', 'last_modified'])
+
+
+class SitemapReader:
+    """Read the sitemaps of a website, pages are yielded as each sitemap is parsed."""
+
+
+    def __init__(self, site_url):
+        site_url = urlparse(site_url)
+        self._homepage_url = '{}://{}/'.format(site_url.scheme, site_url.netloc)
+
+
+    @staticmethod
+    def _tag(element):
+        """Element name without XML namespace."""
+        return element.tag.rpartition('}')[2]
+
+
+    @staticmethod
+    def _fetch(url):
+        """Download a sitemap, returns None if not available."""
+        try:
+            res = http_session.get(url, timeout=SITEMAP_TIMEOUT_S)
+        except requests.RequestException as ex:
+            logging.error('Sitemap: Error loading: %s - %s', url, ex)
+            return None
+
+        if res.status_code != 200:
+            return None
+
+        content = res.content
+        # Gzipped sitemaps are not always served with a gzip content encoding.
+        if content[:2] == b'\x1f\x8b':
+            try:
+                content = gzip.decompress(content)
+            except OSError:
+                logging.error('Sitemap: Invalid gzip file: %s', url)
+                return None
+
+        return content
+
+
+    def _parse(self, url):
+        """Fetch and parse a single sitemap, returns a list of sub sitemap URLs and a list of pages."""
+        content = self._fetch(url)
+        if not content:
+            return [], []
+
+        if url.endswith('robots.txt'):
+            lines = content.decode('utf-8', 'replace').splitlines()
+            sub_sitemaps = [line.partition(':')[2].strip() for line in lines if line.lower().startswith('sitemap:')]
+            return sub_sitemaps, []
+
+        try:
+            root = ElementTree.fromstring(content)
+        except ElementTree.ParseError:
+            # Plain text sitemap, one URL per line.
+            lines = content.decode('utf-8', 'replace').splitlines()
+            return [], [SitemapPage(line.strip(), None) for line in lines if line.strip().startswith('http')]
+
+        sub_sitemaps = []
+        pages = []
+        for entry in root:
+            values = {self._tag(element): (element.text or '').strip() for element in entry}
+            if not values.get('loc'):
+                continue
+
+            if self._tag(root) == 'sitemapindex':
+                sub_sitemaps.append(values['loc'])
+
+            elif self._tag(root) == 'urlset':
+                pages.append(SitemapPage(values['loc'], values.get('lastmod') or None))
+
+        return sub_sitemaps, pages
+
+
+    def pages(self):
+        """Yield all pages of the website, stopping iteration cancels the sitemap downloads still queued."""
+        executor = ThreadPoolExecutor(max_workers=SITEMAP_WORKERS)
+        sitemap_urls = set()
+        pending = set()
+        page_cnt = 0
+
+        def fetch(sitemap_url):
+            if sitemap_url not in sitemap_urls:
+                sitemap_urls.add(sitemap_url)
+                pending.add(executor.submit(self._parse, sitemap_url))
+
+        try:
+            fetch(self._homepage_url + 'robots.txt')
+            for path in SITEMAP_PATHS:
+                fetch(self._homepage_url + path)
+
+            while pending:
+                done, _ = futures_wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+
+                    sub_sitemaps, pages = future.result()
+                    for sub_sitemap in sub_sitemaps:
+                        fetch(sub_sitemap)
+
+                    page_cnt += len(pages)
+                    yield from pages
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+            executor.shutdown(wait=False)
+
+        # Other sitemap formats (RSS, Atom) and locations are left to the full sitemap tree parser.
+        if not page_cnt:
+            logging.warning('Sitemap: No XML sitemaps found, reading the full sitemap tree: %s', self._homepage_url)
+            for page in site_map_tree(self._homepage_url).all_pages():
+                last_modified = page.last_modified.isoformat() if page.last_modified else None
+                yield SitemapPage(page.url, last_modified)
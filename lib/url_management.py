@@ -1,9 +1,17 @@
 """
 URL Management.
 """
+from collections import namedtuple, OrderedDict
+import csv
 import datetime
+import functools
+import hashlib
+import json
 import logging
 import os
+import re
+import threading
+from urllib.parse import urlparse
 
 import pandas as pd
 import tldextract
@@ -13,53 +21,284 @@ import tldextract
 import sidetable
 
 from etc import config
+from .scheduler import FifoScheduler
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 
 pd.set_option('display.precision', 2)
 
+# Number of distinct URLs kept in the normalisation and domain name caches.
+URL_CACHE_SIZE = 100000
+
+# Alias types: the URL redirects to the page, or the page declares another URL as canonical.
+ALIAS_REDIRECT = 'redirect'
+ALIAS_CANONICAL = 'canonical'
+
+# Path segments collapsed in URL templates, in order: numbers, slugs of 3 or more words, and IDs containing digits.
+TEMPLATE_SEGMENTS = [
+    (re.compile(r'^\d+$'), '{n}'),
+    (re.compile(r'^[^\W_]+(?:[-_][^\W_]+){2,}$'), '{slug}'),
+    (re.compile(r'^(?=.*\d)[\w-]{6,}$'), '{id}')
+]
+
+# Crawl state changed since the previous snapshot, see 'UrlManagement.state_changes()'. Pages queued are (url, depth)
+# tuples, pages done were processed, found unreachable or aliased - registry entries are report rows. Aliases dropped
+# are URLs, see 'UrlManagement.drop_alias()'.
+StateChanges = namedtuple(
+    'StateChanges',
+    ['queued', 'done', 'processed', 'unreachable', 'external', 'aliases', 'dropped_aliases', 'sampled_out', 'resources']
+)
+
+
+def audit_detail_key(detail):
+    """Digest of an audit detail item, the same for identical items."""
+    return hashlib.sha1(json.dumps(detail, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def synchronised(method):
+    """Serialise calls to a method on the instance lock, the URL lists are shared by all crawl workers."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ResourceReference:
+    """Aggregated references to a resource across all pages, size in kilobytes and duration in seconds."""
+
+    __slots__ = ['url', 'type', 'cnt', 'pages', 'size', 'duration', 'sample_src_url']
+
+
+    def __init__(self, url, resource_type, sample_src_url):
+        self.url = url
+        self.type = resource_type
+        self.cnt = 0
+        self.pages = 0
+        self.size = 0.0
+        self.duration = 0.0
+        self.sample_src_url = sample_src_url
+
+
+    def as_dict(self):
+        """Report row."""
+        return {
+            'url': self.url,
+            'type': self.type,
+            'cnt': self.cnt,
+            'pages': self.pages,
+            'total_sec': round(self.duration, 2),
+            'total_size': round(self.size, 2),
+            'sample_src_url': self.sample_src_url
+        }
+
+
+class ExternalPage:
+    """Number of references to a page outside of the domain, the status code is only known if the link was checked."""
+
+    __slots__ = ['url', 'cnt', 'status_code']
+
+
+    def __init__(self, url):
+        self.url = url
+        self.cnt = 0
+        self.status_code = None
+
+
+    def as_dict(self):
+        """Report row."""
+        return {'url': self.url, 'cnt': self.cnt, 'status_code': self.status_code}
+
+
+class UnreachablePage:
+    """Number of failed attempts to reach a page."""
+
+    __slots__ = ['url', 'status_code', 'cnt']
+
+
+    def __init__(self, url, status_code):
+        self.url = url
+        self.status_code = status_code
+        self.cnt = 0
+
+
+    def as_dict(self):
+        """Report row."""
+        return {'url': self.url, 'status_code': self.status_code, 'cnt': self.cnt}
+
+
+class AliasPage:
+    """URL of a page measured under another URL, see 'UrlManagement.resolve_alias()'."""
+
+    __slots__ = ['url', 'page_url', 'type']
+
+
+    def __init__(self, url, page_url, alias_type):
+        self.url = url
+        self.page_url = page_url
+        self.type = alias_type
+
+
+    def as_dict(self):
+        """Report row."""
+        return {'url': self.url, 'page_url': self.page_url, 'type': self.type}
+
+
+class UrlTemplate:
+    """Number of distinct URLs found and sampled for measurement of a URL template."""
+
+    __slots__ = ['template', 'cnt', 'sampled', 'sample_url']
+
+
+    def __init__(self, template, sample_url):
+        self.template = template
+        self.cnt = 0
+        self.sampled = 0
+        self.sample_url = sample_url
+
+
+    def as_dict(self):
+        """Report row."""
+        return {'template': self.template, 'cnt': self.cnt, 'sampled': self.sampled, 'sample_url': self.sample_url}
+
+
+class AuditDefinition:
+    """Lighthouse audit, shared by all findings of the audit."""
+
+    __slots__ = ['id', 'title', 'description']
+
+
+    def __init__(self, audit_id, title, description):
+        self.id = audit_id
+        self.title = title
+        self.description = description
+
+
+class AuditFinding:
+    """Failed audit detail item of a page, the detail is a reference into the shared audit details."""
+
+    __slots__ = ['url', 'audit_id', 'finding', 'saving_ms', 'detail_id']
+
+
+    def __init__(self, url, audit_id, finding, saving_ms, detail_id):
+        self.url = url
+        self.audit_id = audit_id
+        self.finding = finding
+        self.saving_ms = saving_ms
+        self.detail_id = detail_id
+
 
 class UrlManagement:
     """Manage URL processing."""
 
     # Resource reference CSV output columns.
-    COLUMNS_RESOURCE_REFERENCES = ['url', 'type', 'cnt']
+    COLUMNS_RESOURCE_REFERENCES = ['url', 'type', 'cnt', 'pages', 'total_sec', 'total_size']
 
     # Resource reference CSV output columns.
-    COLUMNS_EXTERNAL_PAGES = ['url', 'cnt']
+    COLUMNS_EXTERNAL_PAGES = ['url', 'cnt', 'status_code']
 
+    # Audit export CSV output columns - audit definitions and details joined to the findings.
     COLUMNS_AUDIT_RESULTS = ['url', 'id', 'title', 'finding', 'saving_ms', 'description', 'detail']
 
+    COLUMNS_AUDIT_FINDINGS = ['url', 'id', 'finding', 'saving_ms', 'detail_id']
+
+    COLUMNS_AUDIT_DEFINITIONS = ['id', 'title', 'description']
+
+    COLUMNS_AUDIT_DETAILS = ['detail_id', 'detail']
+
     COLUMNS_UNREACHABLE_RESULTS = ['url', 'status_code', 'cnt']
 
+    # Alias CSV output columns.
+    COLUMNS_ALIASES = ['url', 'page_url', 'type']
+
+    # URL template CSV output columns, with the mean results of the pages measured.
+    COLUMNS_TEMPLATES = ['template', 'cnt', 'sampled', 'measured', 'performance', 'total', 'sample_url']
+
     # Basic URL list.
     COLUMNS_BASIC = ['url']
 
 
     def __init__(self):
-        # List of URLs processed.
-        self._processed_pages_list = []
+        # URLs processed, kept in processing order - used as an ordered set.
+        self._processed_pages = OrderedDict()
+
+        # Crawl frontier - URLs to be checked, in the order of the scheduler, see 'set_scheduler()'.
+        self._un_processed_pages = FifoScheduler()
+
+        # Number of links from the start URLs of the pages queued, by URL.
+        self._page_depths = {}
+
+        # Every URL that was queued, processed or found unreachable - never queue these again.
+        self._seen_pages = set()
+
+        # Resources referenced, by URL.
+        self._resource_references = {}
+
+        # Pages that could not be reached, by URL.
+        self._unreachable_pages = {}
+
+        # Pages referenced outside of domain, by URL.
+        self._external_pages = {}
 
-        # List of URLs to be checked.
-        self._un_processed_pages_list = []
+        # URLs redirecting to, or declaring as canonical, a page measured under another URL, by URL.
+        self._alias_pages = {}
 
-        # List of resources referenced.
-        self._resource_references_list = []
+        # Sitemap <lastmod> value of the pages listed in a sitemap, by URL.
+        self._last_modified = {}
 
-        # List of pages that could not be reached.
-        self._unreachable_pages_list = []
+        # Audits failed by any page, by audit ID.
+        self._audit_definitions = {}
 
-        # List of pages referenced outside of domain.
-        self._external_pages_list = []
+        # Distinct audit detail items, the detail ID is the list index.
+        self._audit_details = []
 
-        # List of audit results.
-        self._audit_results_list = []
+        # Detail ID of each distinct audit detail item, by its digest - see 'audit_detail_key()'.
+        self._audit_detail_ids = {}
+
+        # List of failed audit detail items per page.
+        self._audit_findings = []
 
         # Domain name to collect from - everything else is ignored.
         self._domain_name = ''
 
+        # Directory of the crawl state and reports, see 'data_dir()'.
+        self._data_dir = ''
+
+        # Shard of a sharded crawl, internal links owned by other shards are sent to them - None if not sharded.
+        self._shard = None
+
+        # Internal links sent to other shards.
+        self._sent_pages = set()
+
+        # Max pages sampled per URL template, 0 for no limit, overridden by template in 'config.TEMPLATE_SAMPLES'.
+        self._template_samples = 0
+        self._template_sample_overrides = {
+            template.lower(): samples for template, samples in config.TEMPLATE_SAMPLES.items()
+        }
+
+        # URL templates of the pages found, by template.
+        self._url_templates = {}
+
+        # Pages not queued as the sample budget of their URL template was used.
+        self._sampled_out_pages = set()
+
+        # Keys of the crawl state changed since the last snapshot, by 'StateChanges' field - see 'state_changes()'.
+        self._changes = {field: {} for field in StateChanges._fields}
+
+        # Matches URLs starting with one of the excluded paths, None if there are none.
+        self._exclude_pattern = self._compile_prefixes(config.EXCLUDE_PATHS)
+
+        # Re-entrant as managed methods call each other.
+        self.lock = threading.RLock()
+
+        # Reports written to as results come in - report name: (file, CSV writer).
+        self._report_streams = {}
+
 
     @staticmethod
+    @functools.lru_cache(maxsize=URL_CACHE_SIZE)
     def _prep_url(url):
         """Normalise URL."""
 
@@ -75,19 +314,162 @@ class UrlManagement:
 
 
     @staticmethod
-    def _list_item_starts_with(item, item_list):
-        """Check if a list item starts with a certain value."""
-        res = [i for i in item_list if i.startswith(item)]
-        return bool(res)
+    @functools.lru_cache(maxsize=URL_CACHE_SIZE)
+    def _url_domain(url):
+        """Domain name of a URL, without subdomains and suffix."""
+        return tldextract.extract(url).domain
+
+
+    @staticmethod
+    def _compile_prefixes(prefixes):
+        """Compile a list of URL prefixes into a single regular expression."""
+        if not prefixes:
+            return None
 
+        return re.compile('|'.join(re.escape(prefix.lower()) for prefix in prefixes))
 
-    def set_domain_name(self, domain_name):
-        "Set the domain name to filter on."
+
+    def _is_excluded(self, page_url):
+        """Check if a URL starts with one of the excluded paths."""
+        return bool(self._exclude_pattern and self._exclude_pattern.match(page_url))
+
+
+    def set_domain_name(self, domain_name, data_dir=None):
+        "Set the domain name to filter on, and the directory of its data if not the domain directory."
         self._domain_name = self._prep_url(domain_name)
+        self._data_dir = data_dir or 'var/{}/'.format(self._domain_name)
+
+
+    def data_dir(self):
+        """Directory of the crawl state and reports."""
+        return self._data_dir or 'var/'
+
+
+    def set_shard(self, shard):
+        """Only queue the pages of a shard, see 'Shard'."""
+        self._shard = shard
+
+
+    def shard_key(self, page_url):
+        """Pages are assigned to shards by URL, or by URL template when sampled so that budgets hold across shards."""
+        return self.url_template(page_url) if self._sampling() else page_url
+
+
+    def in_shard(self, url):
+        """Check if a page is processed by this process."""
+        return not self._shard or self._shard.owns(self.shard_key(self._prep_url(url)))
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=URL_CACHE_SIZE)
+    def url_template(url):
+        """Path of a URL with its numeric, ID and slug segments collapsed, e.g. '/products/{slug}'."""
+        segments = []
+        for segment in urlparse(url).path.split('/')[1:]:
+            stem, dot, extension = segment.partition('.')
+            for pattern, placeholder in TEMPLATE_SEGMENTS:
+                if pattern.match(stem):
+                    stem = placeholder
+                    break
+
+            segments.append(stem + dot + extension)
+
+        return '/' + '/'.join(segments)
+
+
+    def set_template_samples(self, samples):
+        """Set the max number of pages sampled per URL template, 0 for no limit."""
+        self._template_samples = samples
+
+
+    def _sampling(self):
+        """Check if URL templates have sample budgets."""
+        return bool(self._template_samples or self._template_sample_overrides)
+
+
+    def _sample_page(self, page_url, force=False):
+        """
+        Count a new page in its URL template, returns False if the sample budget of the template is used.
+
+        Pages already measured, or otherwise handled, are forced into the sample.
+        """
+        if page_url in self._sampled_out_pages:
+            return False
+
+        template = self.url_template(page_url)
+        url_template = self._url_templates.get(template)
+        if not url_template:
+            url_template = self._url_templates[template] = UrlTemplate(template, page_url)
+
+        url_template.cnt += 1
+
+        budget = self._template_sample_overrides.get(template, self._template_samples)
+        if budget and url_template.sampled >= budget and not force:
+            self._sampled_out_pages.add(page_url)
+            self._changes['sampled_out'][page_url] = None
+            return False
+
+        url_template.sampled += 1
+
+        return True
+
+
+    def _see(self, page_url):
+        """Register a page as seen, pages not queued before are counted in their URL template."""
+        if page_url not in self._seen_pages:
+            self._seen_pages.add(page_url)
+            self._sample_page(page_url, force=True)
+
+
+    def _queued(self, page_url, depth):
+        """Record a page queued, it is stored with the frontier until done."""
+        self._changes['queued'][page_url] = depth
+        self._changes['done'].pop(page_url, None)
+
+
+    def _done(self, page_url):
+        """Record a page processed, found unreachable or aliased, it is taken off the stored frontier."""
+        self._changes['done'][page_url] = None
+        self._changes['queued'].pop(page_url, None)
 
 
-    def unprocessed_pages(self, urls=None, action='add', clone=True):
-        """Manage accessing and processing of URLs for pages to be processed."""
+    def is_internal(self, url):
+        """Check if a URL is a page of the domain that is not excluded."""
+        page_url = self._prep_url(url)
+        return self._url_domain(page_url) == self._domain_name and not self._is_excluded(page_url)
+
+
+    @synchronised
+    def set_scheduler(self, scheduler):
+        """Order the frontier with another scheduler, see the 'scheduler' module."""
+        for page_url in self._un_processed_pages.urls():
+            scheduler.add(page_url, self._page_depths.get(page_url, 0))
+
+        self._un_processed_pages = scheduler
+
+
+    def url_grouping(self, url):
+        """Report grouping of a URL, see 'config.DF_GROUP_BY'."""
+        grouping = 'Not categorised'
+        for key, value in config.DF_GROUP_BY.items():
+            if value in url:
+                grouping = key
+
+        return grouping
+
+
+    @synchronised
+    def page_depth(self, url):
+        """Number of links from the start URLs to a page queued before, 0 if not known."""
+        return self._page_depths.get(self._prep_url(url), 0)
+
+
+    @synchronised
+    def unprocessed_pages(self, urls=None, action='add', clone=True, depth=0):
+        """
+        Manage accessing and processing of URLs for pages to be processed, 'depth' is the number of links from the
+        start URLs of the URLs added.
+        """
         if urls:
             # Convert a string to a list.
             if isinstance(urls, str):
@@ -95,110 +477,194 @@ class UrlManagement:
 
             for url in urls:
                 page_url = self._prep_url(url)
-                domain_name = tldextract.extract(page_url).domain
+                domain_name = self._url_domain(page_url)
 
                 # Filter out telephone numbers and email addresses.
                 if domain_name == '' or '@' in page_url:
                     continue
 
-                if domain_name == self._domain_name and not self._list_item_starts_with(page_url, config.EXCLUDE_PATHS):
-                    if page_url in self._un_processed_pages_list:
-                        if action == 'delete':
-                            self._un_processed_pages_list.remove(page_url)
+                if domain_name == self._domain_name and not self._is_excluded(page_url):
+                    if action == 'delete':
+                        if self._un_processed_pages.remove(page_url):
                             return []
-                    else:
-                        self._un_processed_pages_list.append(page_url)
+
+                    elif self._shard and not self._shard.owns(self.shard_key(page_url)):
+                        if page_url not in self._sent_pages:
+                            self._sent_pages.add(page_url)
+                            self._shard.send(page_url, self.shard_key(page_url))
+
+                    elif page_url not in self._seen_pages and self._sample_page(page_url):
+                        self._seen_pages.add(page_url)
+                        self._page_depths[page_url] = depth
+                        self._un_processed_pages.add(page_url, depth)
+                        self._queued(page_url, depth)
                 else:
                     self.external_pages(page_url)
 
             return []
 
-        if clone:
-            return list(self._un_processed_pages_list)
+        # Live, read-only view of the frontier if not cloned.
+        return self._un_processed_pages.urls(clone)
+
 
-        return self._un_processed_pages_list
+    @synchronised
+    def next_unprocessed_page(self):
+        """Remove and return the next URL to be processed, or None if the frontier is empty."""
+        return self._un_processed_pages.pop()
 
 
+    @synchronised
+    def unprocessed_count(self):
+        """Number of URLs waiting to be processed."""
+        return len(self._un_processed_pages)
+
+
+    @synchronised
+    def is_unreachable(self, url):
+        """Check if a URL was found unreachable."""
+        return self._prep_url(url) in self._unreachable_pages
+
+
+    @synchronised
+    def is_seen(self, url):
+        """Check if a URL was already queued, processed or found unreachable."""
+        return self._prep_url(url) in self._seen_pages
+
+
+    @synchronised
+    def state_changes(self):
+        """Crawl state changed since the previous call, see 'StateChanges'."""
+        changes, self._changes = self._changes, {field: {} for field in StateChanges._fields}
+
+        return StateChanges(
+            queued=list(changes['queued'].items()),
+            done=list(changes['done']),
+            processed=list(changes['processed']),
+            unreachable=[self._unreachable_pages[url].as_dict() for url in changes['unreachable']],
+            external=[self._external_pages[url].as_dict() for url in changes['external']],
+            aliases=[self._alias_pages[url].as_dict() for url in changes['aliases']],
+            dropped_aliases=list(changes['dropped_aliases']),
+            sampled_out=list(changes['sampled_out']),
+            resources=[self._resource_references[url].as_dict() for url in changes['resources']]
+        )
+
+
+    @synchronised
+    def last_modified(self, url, last_modified=None):
+        """Register the sitemap <lastmod> value of a page, returns the registered value or None."""
+        page_url = self._prep_url(url)
+
+        if last_modified:
+            self._last_modified[page_url] = last_modified
+
+        return self._last_modified.get(page_url)
+
+
+    @synchronised
     def processed_pages(self, url=None):
         """Manage accessing and processing of URLs for pages processed."""
         if url:
             page_url = self._prep_url(url)
 
-            self.unprocessed_pages(page_url, 'delete')
+            self._un_processed_pages.remove(page_url)
+            self._see(page_url)
 
-            if page_url not in self._processed_pages_list:
-                self._processed_pages_list.append(page_url)
+            if page_url not in self._processed_pages:
+                self._processed_pages[page_url] = True
+                self._changes['processed'][page_url] = None
+                self._done(page_url)
+                self.stream_report('processed_uri', self.COLUMNS_BASIC, [{'url': page_url}])
 
             return []
 
-        return list(self._processed_pages_list)
+        return list(self._processed_pages)
 
 
-    def processed_resource_references(self, source_url=None, url=None, resource_type=None):
+    @synchronised
+    def processed_resource_references(self, source_url=None, url=None, resource_type=None, cnt=1, size=0.0,
+                                      duration=0.0, pages=1):
         """
-        Manage access to 'resource_references_list' variable.
+        Manage access to '_resource_references' variable.
 
         Object structure:
         {
             'url': str,
             'type': '',
-            'cnt': 0
+            'cnt': 0,
+            'pages': 0,
+            'total_sec': 0.0,
+            'total_size': 0.0,
             'sample_src_url': ''
         }
         """
         if url and resource_type:
             resource_url = self._prep_url(url)
 
-            resource = [resource for resource in self._resource_references_list if resource['url'] == resource_url]
-            if resource:
-                resource[0]['cnt'] = resource[0]['cnt'] + 1
-                return []
-
-            self._resource_references_list.append(
-                {
-                    'url': resource_url,
-                    'type': resource_type,
-                    'cnt': 1,
-                    'sample_src_url': source_url
-                }
-            )
+            resource = self._resource_references.get(resource_url)
+            if not resource:
+                resource = self._resource_references[resource_url] = ResourceReference(
+                    resource_url, resource_type, source_url
+                )
+
+            resource.cnt += cnt
+            resource.pages += pages
+            resource.size += size
+            resource.duration += duration
+            self._changes['resources'][resource_url] = None
 
             return []
 
-        return list(self._resource_references_list)
+        return [resource.as_dict() for resource in self._resource_references.values()]
+
+
+    @synchronised
+    def add_page_resources(self, source_url, resources):
+        """
+        Register the resources loaded by a page, as (url, type, cnt, size, duration) tuples.
+
+        Every resource counts a single referencing page, however often the page loaded it.
+        """
+        referenced = set()
+        for url, resource_type, cnt, size, duration in resources:
+            resource_url = self._prep_url(url)
+            pages = 0 if resource_url in referenced else 1
+            referenced.add(resource_url)
+
+            self.processed_resource_references(source_url, resource_url, resource_type, cnt, size, duration, pages)
 
 
-    def external_pages(self, url=None):
+    @synchronised
+    def external_pages(self, url=None, cnt=1, status_code=None):
         """
-        Manage access to '_external_pages_list' variable.
+        Manage access to '_external_pages' variable.
 
         Object structure:
         {
             'url': '',
-            'cnt': 0
+            'cnt': 0,
+            'status_code': None
         }
         """
         if url:
             resource_url = self._prep_url(url)
-            resource = [resource for resource in self._external_pages_list if resource['url'] == resource_url]
 
-            if resource:
-                resource[0]['cnt'] = resource[0]['cnt'] + 1
-                return []
+            resource = self._external_pages.get(resource_url)
+            if not resource:
+                resource = self._external_pages[resource_url] = ExternalPage(resource_url)
 
-            self._external_pages_list.append(
-                {
-                    'url': resource_url,
-                    'cnt': 1
-                }
-            )
+            resource.cnt += cnt
+            if status_code is not None:
+                resource.status_code = status_code
+
+            self._changes['external'][resource_url] = None
 
             return []
 
-        return list(self._external_pages_list)
+        return [resource.as_dict() for resource in self._external_pages.values()]
 
 
-    def unreachable_pages(self, url=None, status_code=None):
+    @synchronised
+    def unreachable_pages(self, url=None, status_code=None, cnt=1):
         """
         List of URLs that could not be reached.
 
@@ -212,57 +678,220 @@ class UrlManagement:
         if url and status_code:
             resource_url = self._prep_url(url)
 
-            self.unprocessed_pages(url, 'delete')
+            self._un_processed_pages.remove(resource_url)
+            self._see(resource_url)
 
-            resource = [resource for resource in self._unreachable_pages_list if resource['url'] == resource_url]
+            resource = self._unreachable_pages.get(resource_url)
+            if not resource:
+                resource = self._unreachable_pages[resource_url] = UnreachablePage(resource_url, status_code)
 
-            if resource:
-                resource[0]['cnt'] = resource[0]['cnt'] + 1
-                return []
+            resource.cnt += cnt
+            self._changes['unreachable'][resource_url] = None
+            self._done(resource_url)
+
+            return []
+
+        return [resource.as_dict() for resource in self._unreachable_pages.values()]
 
-            self._unreachable_pages_list.append(
-                {
-                    'url': resource_url,
-                    'status_code': status_code,
-                    'cnt': 1
-                }
-            )
+
+    @synchronised
+    def alias_pages(self, url=None, page_url=None, alias_type=None):
+        """
+        List of URLs measured under another URL.
+
+        Object structure:
+        {
+            'url': '',
+            'page_url': '',
+            'type': ''
+        }
+        """
+        if url and page_url:
+            alias_url = self._prep_url(url)
+
+            self._un_processed_pages.remove(alias_url)
+            self._see(alias_url)
+            self._alias_pages[alias_url] = AliasPage(alias_url, self._prep_url(page_url), alias_type)
+            self._changes['aliases'][alias_url] = None
+            self._changes['dropped_aliases'].pop(alias_url, None)
+            self._done(alias_url)
 
             return []
 
-        return list(self._unreachable_pages_list)
+        return [alias.as_dict() for alias in self._alias_pages.values()]
+
+
+    @synchronised
+    def drop_alias(self, url):
+        """Measure an alias under its own URL again, e.g. when the page it resolved to cannot be reached."""
+        alias_url = self._prep_url(url)
 
+        if self._alias_pages.pop(alias_url, None):
+            logging.info('Alias: %s - dropped', alias_url)
+            self._changes['aliases'].pop(alias_url, None)
+            self._changes['dropped_aliases'][alias_url] = None
+            self._queued(alias_url, self._page_depths.get(alias_url, 0))
 
-    def audit_results(self, url=None, item=None, detail=None):
+
+    @synchronised
+    def resolve_alias(self, url, final_url=None, canonical_url=None, claim_canonical=True):
         """
-        Manage access to '_audit_results_list' variable.
+        URL to measure a page under: its canonical URL, or else the URL it redirects to.
+
+        A URL resolving to another page is registered as alias of that page, which is then taken off the frontier to be
+        measured by the caller. None is returned if the page is not measured by the caller: it is already measured
+        or being measured, outside of the domain, owned by another shard, or a canonical URL not to be claimed - it is
+        queued instead.
+        """
+        page_url = self._prep_url(url)
+
+        target_url, alias_type = page_url, None
+        for candidate_url, candidate_type in ((final_url, ALIAS_REDIRECT), (canonical_url, ALIAS_CANONICAL)):
+            candidate_url = self._prep_url(candidate_url)
+            # A page redirected to a URL declaring it as canonical, e.g. http to https, is not an alias of itself.
+            if candidate_url and candidate_url not in (page_url, target_url):
+                target_url, alias_type = candidate_url, candidate_type
+
+        # Aliases of each other, e.g. canonical URLs pointing back, are measured under the URL found first. Pages are
+        # measured under their own URL if the URL resolved to is known to be unreachable, see 'drop_alias()'.
+        if not alias_type or target_url in self._alias_pages or target_url in self._unreachable_pages:
+            return url
+
+        self.alias_pages(page_url, target_url, alias_type)
+        logging.info('Alias: %s - %s of: %s', page_url, alias_type, target_url)
+
+        if (not self.is_internal(target_url) or (self._shard and not self._shard.owns(self.shard_key(target_url)))
+                or (alias_type == ALIAS_CANONICAL and not claim_canonical)):
+            self.unprocessed_pages(target_url)
+            return None
+
+        if not self._un_processed_pages.remove(target_url):
+            # Already measured or being measured, or not sampled.
+            if target_url in self._seen_pages or not self._sample_page(target_url):
+                return None
+
+            self._seen_pages.add(target_url)
+            self._page_depths[target_url] = self._page_depths.get(page_url, 0)
+            self._queued(target_url, self._page_depths[target_url])
+
+        return target_url
+
+
+    @synchronised
+    def url_templates(self):
+        """List of the URL templates of the pages found, see 'UrlTemplate'."""
+        return [url_template.as_dict() for url_template in self._url_templates.values()]
+
+
+    @synchronised
+    def sampled_out_pages(self, url=None):
+        """Manage the pages not queued as the sample budget of their URL template was used."""
+        if url:
+            page_url = self._prep_url(url)
+
+            if page_url not in self._sampled_out_pages and page_url not in self._seen_pages:
+                template = self.url_template(page_url)
+                url_template = self._url_templates.get(template)
+                if not url_template:
+                    url_template = self._url_templates[template] = UrlTemplate(template, page_url)
+
+                url_template.cnt += 1
+                self._sampled_out_pages.add(page_url)
+                self._changes['sampled_out'][page_url] = None
+
+            return []
+
+        return list(self._sampled_out_pages)
+
+
+    @synchronised
+    def audit_results(self, url=None, item=None, detail=None, start=0):
+        """
+        Manage access to the audit findings.
+
+        Audit titles and descriptions are stored once per audit and identical detail items once per run. Returns
+        the findings from index 'start' joined with their audit and detail.
+
+        Object structure:
+        {
+            'url': '',
+            'id': '',
+            'title': '',
+            'finding': '',
+            'saving_ms': 0,
+            'description': '',
+            'detail': {}
+        }
         """
 
         if url:
             resource_url = self._prep_url(url)
+            audit_id = item.get('id', 'No ID')
+
+            if audit_id not in self._audit_definitions:
+                self._audit_definitions[audit_id] = AuditDefinition(
+                    audit_id, item.get('title', 'No Title'), item['description']
+                )
+
+            detail_key = audit_detail_key(detail)
+            detail_id = self._audit_detail_ids.get(detail_key)
+            if detail_id is None:
+                detail_id = self._audit_detail_ids[detail_key] = len(self._audit_details)
+                self._audit_details.append(detail)
 
-            self._audit_results_list.append(
-                {
-                    'url': resource_url,
-                    'id': item.get('id', 'No ID'),
-                    'title': item.get('title', 'No Title'),
-                    'finding': item.get('displayValue', ''),
-                    'saving_ms': item.get('overallSavingsMs', 0),
-                    'description': item['description'],
-                    'detail': detail
-                }
+            audit_finding = AuditFinding(
+                resource_url, audit_id, item.get('displayValue', ''), item.get('overallSavingsMs', 0), detail_id
             )
+            self._audit_findings.append(audit_finding)
+
+            self.stream_report('audit_finding', self.COLUMNS_AUDIT_FINDINGS, [{
+                'url': audit_finding.url,
+                'id': audit_finding.audit_id,
+                'finding': audit_finding.finding,
+                'saving_ms': audit_finding.saving_ms,
+                'detail_id': audit_finding.detail_id
+            }])
 
             return []
 
-        return list(self._audit_results_list)
+        results = []
+        for audit_finding in self._audit_findings[start:]:
+            audit = self._audit_definitions[audit_finding.audit_id]
+            results.append({
+                'url': audit_finding.url,
+                'id': audit.id,
+                'title': audit.title,
+                'finding': audit_finding.finding,
+                'saving_ms': audit_finding.saving_ms,
+                'description': audit.description,
+                'detail': self._audit_details[audit_finding.detail_id]
+            })
+
+        return results
+
+
+    @synchronised
+    def audit_definitions(self):
+        """List of audits failed by any page."""
+        return [
+            {'id': audit.id, 'title': audit.title, 'description': audit.description}
+            for audit in self._audit_definitions.values()
+        ]
+
+
+    @synchronised
+    def audit_details(self):
+        """List of distinct audit detail items."""
+        return [
+            {'detail_id': detail_id, 'detail': json.dumps(detail)}
+            for detail_id, detail in enumerate(self._audit_details)
+        ]
 
 
     @staticmethod
-    def analysis_report(columns, values):
+    def analysis_report(data_frame):
         """Print a summary of the report to the console."""
 
-        data_frame = pd.DataFrame(values, columns=columns)
         if not data_frame.dropna().empty:
             print('\nSummary:')
             print(data_frame.describe())
@@ -281,33 +910,93 @@ class UrlManagement:
             print(data_frame.stb.freq(['grouping']))
             print('')
 
+            if data_frame['template'].notna().any():
+                print('--------------------------------------')
+                print('Mean by template:')
+                print(data_frame.groupby('template', as_index=True)[['performance', 'total']].agg(['count', 'mean']))
+                print('')
 
-    def generate_report(self, file_name, columns, values):
-        """Output URL lists to CSV."""
-        if values:
-            if self._domain_name:
-                dir_path = 'var/{}/{}/'.format(self._domain_name, datetime.datetime.now().strftime('%Y-%m-%d'))
-            else:
-                dir_path = 'var/{}/'.format(datetime.datetime.now().strftime('%Y-%m-%d'))
 
-            if not os.path.exists(dir_path):
-                os.makedirs(dir_path)
+    def template_report(self, data_frame):
+        """Output the URL templates, with the number of pages measured and their mean results."""
+        results = data_frame.dropna(subset=['template']).groupby('template').agg(
+            measured=('url', 'size'), performance=('performance', 'mean'), total=('total', 'mean')
+        )
+
+        rows = []
+        for url_template in self.url_templates():
+            url_template['measured'] = 0
+            if url_template['template'] in results.index:
+                summary = results.loc[url_template['template']]
+                url_template['measured'] = int(summary['measured'])
+                url_template['performance'] = round(summary['performance'], 2)
+                url_template['total'] = round(summary['total'], 2)
+
+            rows.append(url_template)
+
+        self.generate_report('url_template', self.COLUMNS_TEMPLATES, rows)
 
-            file_name = '{}_{}.csv'.format(file_name, datetime.datetime.now().strftime('%H-%M-%S'))
-            full_path = '{}{}'.format(dir_path, file_name)
 
+    def report_path(self, file_name, extension='csv', timestamp=True):
+        """
+        Full path of a new report.
+
+        Reports without timestamp are kept in the data directory and replaced by every run.
+        """
+        dir_path = self.data_dir()
+
+        if timestamp:
+            dir_path += '{}/'.format(datetime.datetime.now().strftime('%Y-%m-%d'))
+            file_name = '{}_{}'.format(file_name, datetime.datetime.now().strftime('%H-%M-%S'))
+
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        return '{}{}.{}'.format(dir_path, file_name, extension)
+
+
+    def generate_report(self, file_name, columns, values):
+        """Output URL lists to CSV."""
+        if values:
             data_frame = pd.DataFrame(values, columns=columns)
-            data_frame.to_csv(path_or_buf=full_path, index=False)
+            data_frame.to_csv(path_or_buf=self.report_path(file_name), index=False)
 
         else:
             logging.warning('Report: %s - nothing to report on.', file_name)
 
 
+    @synchronised
+    def stream_report(self, file_name, columns, values):
+        """Append rows to a CSV report, the file is created on first use and flushed after every call."""
+        if file_name not in self._report_streams:
+            file = open(self.report_path(file_name), 'w', newline='')
+            writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            self._report_streams[file_name] = (file, writer)
+
+        file, writer = self._report_streams[file_name]
+        writer.writerows(values)
+        file.flush()
+
+
+    @synchronised
+    def close_reports(self):
+        """Close all streamed reports."""
+        for file, _ in self._report_streams.values():
+            file.close()
+
+        self._report_streams = {}
+
+
     def generate_internal_reports(self):
         """Write the output of the results to file."""
+        # The processed and audit finding reports are streamed, the other reports hold counters only final at the end.
         self.generate_report('external_uri', self.COLUMNS_EXTERNAL_PAGES, self.external_pages())
         self.generate_report('resource_uri', self.COLUMNS_RESOURCE_REFERENCES, self.processed_resource_references())
-        self.generate_report('processed_uri', self.COLUMNS_BASIC, self.processed_pages())
         self.generate_report('unreachable_uri', self.COLUMNS_UNREACHABLE_RESULTS, self.unreachable_pages())
+        self.generate_report('alias_uri', self.COLUMNS_ALIASES, self.alias_pages())
         self.generate_report('unprocessed_uri', self.COLUMNS_BASIC, self.unprocessed_pages())
+        self.generate_report('audit_definition', self.COLUMNS_AUDIT_DEFINITIONS, self.audit_definitions())
+        self.generate_report('audit_detail', self.COLUMNS_AUDIT_DETAILS, self.audit_details())
         self.generate_report('audit', self.COLUMNS_AUDIT_RESULTS, self.audit_results())
+        self.close_reports()
@@ -0,0 +1,241 @@
+"""
+Browser worker pool.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Checked pages queued per browser, see 'WorkerPool.run()'.
+CHECK_QUEUE_PER_WORKER = 2
+
+
+class WorkerPool:
+    """
+    Process pages from the shared URL frontier with a pool of browser instances.
+
+    Pages can first go through a check stage, e.g. a status pre-check, run by its own worker threads. Checked pages
+    are handed to the browsers through a bounded queue, so that the slowest stage sets the pace.
+    """
+
+
+    def __init__(self, url_mgmt, process_page, max_urls=0, check_page=None, check_workers=0, queue_size=0):
+        # Shared URL frontier.
+        self._url_mgmt = url_mgmt
+
+        # Callable processing a single page: process_page(browser, url), or process_page(browser, url, check=check)
+        # for pages that passed the check stage.
+        self._process_page = process_page
+
+        # Callable checking a single page: check_page(url), returns a falsy value if the page is not to be processed.
+        self._check_page = check_page
+        self._check_workers = check_workers if check_page else 0
+
+        # Max number of checked pages waiting for a browser, 0 for 'CHECK_QUEUE_PER_WORKER' per browser.
+        self._queue_size = queue_size
+
+        # Max number of URLs to process, 0 for no limit.
+        self._max_urls = max_urls
+
+        # Guards the counters below and wakes up idle workers when a page completes.
+        self._condition = threading.Condition()
+
+        # Number of pages handed out to workers.
+        self._proc_cnt = 0
+
+        # Number of pages currently being checked, queued or processed - these can still add links to the frontier.
+        self._in_flight = 0
+
+        # Set when the crawl is interrupted, workers finish their current page and exit.
+        self._stopped = False
+
+        # Number of URL sources still adding pages to the frontier.
+        self._feeding = 0
+
+        # Checked pages waiting for a browser - (url, check, proc_cnt).
+        self._checked = deque()
+
+
+    def _next_page(self):
+        """Wait for the next page to process, returns None when the crawl is complete."""
+        with self._condition:
+            while True:
+                if self._stopped or (self._max_urls and self._proc_cnt >= self._max_urls):
+                    return None
+
+                page = self._url_mgmt.next_unprocessed_page()
+                if page:
+                    self._proc_cnt += 1
+                    self._in_flight += 1
+                    return page, self._proc_cnt
+
+                # Frontier is empty and nothing can add to it anymore.
+                if not self._in_flight and not self._feeding:
+                    return None
+
+                self._condition.wait()
+
+
+    def _next_checked_page(self):
+        """Wait for the next checked page, returns None when the crawl is complete."""
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+
+                if self._checked:
+                    # Room in the queue for the check workers.
+                    self._condition.notify_all()
+                    return self._checked.popleft()
+
+                # Nothing is being checked or processed, and no more pages will be handed out.
+                if not self._in_flight and (
+                        (self._max_urls and self._proc_cnt >= self._max_urls)
+                        or (not self._url_mgmt.unprocessed_count() and not self._feeding)
+                ):
+                    return None
+
+                self._condition.wait()
+
+
+    def _queue_checked(self, page, check, proc_cnt, queue_size):
+        """Hand a checked page to the browsers, waits while the queue is full."""
+        with self._condition:
+            while len(self._checked) >= queue_size and not self._stopped:
+                self._condition.wait()
+
+            if self._stopped:
+                return False
+
+            self._checked.append((page, check, proc_cnt))
+            self._condition.notify_all()
+
+            return True
+
+
+    def _page_done(self, page, proc_cnt, progress):
+        """Report progress and wake up idle workers."""
+        with self._condition:
+            self._in_flight -= 1
+
+            if progress:
+                progress(proc_cnt, self._url_mgmt.unprocessed_count() + self._proc_cnt, page)
+
+            self._condition.notify_all()
+
+
+    def _worker(self, browser, progress):
+        """Process pages with a single browser instance until the crawl is complete."""
+        while True:
+            next_page = self._next_page()
+            if not next_page:
+                return
+
+            page, proc_cnt = next_page
+            try:
+                self._process_page(browser, page)
+            finally:
+                self._page_done(page, proc_cnt, progress)
+
+
+    def _checked_worker(self, browser, progress):
+        """Process checked pages with a single browser instance until the crawl is complete."""
+        while True:
+            next_page = self._next_checked_page()
+            if not next_page:
+                return
+
+            page, check, proc_cnt = next_page
+            try:
+                self._process_page(browser, page, check=check)
+            finally:
+                self._page_done(page, proc_cnt, progress)
+
+
+    def _check_worker(self, progress, queue_size):
+        """Check pages from the frontier, pages to process are queued for the browsers."""
+        while True:
+            next_page = self._next_page()
+            if not next_page:
+                return
+
+            page, proc_cnt = next_page
+            queued = False
+            try:
+                check = self._check_page(page)
+                if check:
+                    queued = self._queue_checked(page, check, proc_cnt, queue_size)
+            finally:
+                if not queued:
+                    self._page_done(page, proc_cnt, progress)
+
+
+    def _feed(self, source):
+        """Add the URLs of a source to the frontier as they become available."""
+        try:
+            for url in source:
+                if self._stopped:
+                    break
+
+                self._url_mgmt.unprocessed_pages(url)
+                with self._condition:
+                    self._condition.notify_all()
+        finally:
+            # Closes generator sources, see 'SitemapReader.pages()'.
+            if hasattr(source, 'close'):
+                source.close()
+
+            with self._condition:
+                self._feeding -= 1
+                self._condition.notify_all()
+
+
+    @property
+    def stopped(self):
+        """Check if the crawl was interrupted."""
+        return self._stopped
+
+
+    def idle(self, feeds=1):
+        """
+        Check if no page is in flight and none is left to hand out, while at most 'feeds' URL sources are still
+        running - e.g. the source calling this, see 'Shard.inbox()'.
+        """
+        with self._condition:
+            return not self._in_flight and self._feeding <= feeds and (
+                (self._max_urls and self._proc_cnt >= self._max_urls) or not self._url_mgmt.unprocessed_count()
+            )
+
+
+    def stop(self):
+        """Stop handing out pages to the workers."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+    def run(self, browsers, progress=None, sources=()):
+        """
+        Process the frontier with one worker thread per browser.
+
+        URL sources, e.g. 'process_sitemap()', are read on separate threads while the workers process pages.
+        """
+        self._feeding = len(sources)
+        queue_size = self._queue_size or CHECK_QUEUE_PER_WORKER * len(browsers)
+
+        with ThreadPoolExecutor(max_workers=len(browsers) + len(sources) + self._check_workers) as executor:
+            futures = [executor.submit(self._feed, source) for source in sources]
+
+            if self._check_workers:
+                futures += [
+                    executor.submit(self._check_worker, progress, queue_size) for _ in range(self._check_workers)
+                ]
+                futures += [executor.submit(self._checked_worker, browser, progress) for browser in browsers]
+            else:
+                futures += [executor.submit(self._worker, browser, progress) for browser in browsers]
+
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                self.stop()
+                raise
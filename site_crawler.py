@@ -2,13 +2,16 @@
 """
 Site crawler application.
 """
+import functools
 import sys
 
 import traceback
 import tldextract
 from etc import config
 from lib import report_results, conf_browser, logging, process_args, process_url, process_sitemap, url_mgmt
-from lib import delete_reports
+from lib import delete_reports, google_insights, WorkerPool, crawl_store, resume_crawl, insights_cache, check_links
+from lib import BrowserSession, ENGINE_BROWSER, RunProfiler, check_url, Shard, run_shards, merge_shards, shard_dir
+from lib import shards_dir, conf_scheduler
 
 
 def main():
@@ -16,10 +19,14 @@ def main():
     Command-line entrypoint to process a URL or sitemap and show a report if needed.
     """
 
-    browser = None
-    results = []
+    browsers = []
+    shard = None
     args = process_args()
 
+    profiler = RunProfiler() if args.profile else None
+    if profiler:
+        profiler.start()
+
     try:
         if args.remove_reports:
             delete_reports()
@@ -31,50 +38,112 @@ def main():
             return
 
         domain_name = tldextract.extract(source_url_path).domain
-        url_mgmt.set_domain_name(domain_name)
+        url_mgmt.set_template_samples(args.template_samples)
+
+        # Each shard processes its share of --max pages, a shard with no share would not stop.
+        if args.shards and 0 < args.max < args.shards:
+            logging.error('Max number of URLs must be 0 or at least the number of --shards.')
+            return
+
+        if args.shard_index is not None:
+            if not 0 <= args.shard_index < args.shards:
+                logging.error('Shard index must be from 0 to the number of --shards.')
+                return
 
-        browser = conf_browser()
+            # Each shard keeps its crawl state and reports apart, and uses its share of the Insights API quota and of
+            # the max number of URLs, spread evenly.
+            args.max = args.max // args.shards + (args.shard_index < args.max % args.shards) if args.max else 0
+            url_mgmt.set_domain_name(domain_name, shard_dir(domain_name, args.shard_index))
+            shard = Shard(shards_dir(domain_name), args.shard_index, args.shards)
+            url_mgmt.set_shard(shard)
+            google_insights.share_quota(args.shards)
 
+        else:
+            url_mgmt.set_domain_name(domain_name)
+
+            # Run a process per shard, the results are merged once all shards completed.
+            if args.shards:
+                if args.merge_shards or run_shards(domain_name, args.shards, args.resume):
+                    merge_shards(domain_name, args.shards)
+                return
+
+            if args.merge_shards:
+                logging.error('Merging shards requires the number of --shards.')
+                return
+
+        crawl_store.open(url_mgmt.data_dir(), args.resume, args.incremental)
+        insights_cache.open(args.cache_ttl * 3600)
+        conf_scheduler(args.scheduler)
+        if args.resume:
+            resume_crawl(args.debug)
+
+        # A resumed crawl continues with the stored frontier, the sitemap is read again for the pages not found yet -
+        # the crawl may have stopped before the whole sitemap was read.
+        sources = []
         if args.url:
             url_mgmt.unprocessed_pages(args.url)
 
         else:
-            url_mgmt.unprocessed_pages(process_sitemap(args.siteurl, args.max))
+            sources.append(process_sitemap(args.siteurl, args.max))
+
+        def show_progress(proc_cnt, total, page):
+            # Print progress information - to be improved.
+            sys.stdout.write('\033[2K\033[1G')
+            sys.stdout.flush()
+            print('({}/{})| {}'.format(proc_cnt, total, page.partition(domain_name )[2]), end='')
+            sys.stdout.flush()
 
-        proc_cnt = 0
-        while True:
-            if url_mgmt.unprocessed_pages(clone=False):
-                if args.max:
-                    if proc_cnt == args.max:
-                        break
+        if args.links_only:
+            check_links(args.follow, args.max, show_progress, sources, shard)
+            return
 
-                proc_cnt += 1
-                total = len(url_mgmt.unprocessed_pages(clone=False)) + proc_cnt
+        browsers = [
+            conf_browser(args.engine, args.load_strategy, args.recycle_pages, args.recycle_memory)
+            for _ in range(max(args.workers, 1))
+        ]
 
-                page = url_mgmt.unprocessed_pages(clone=False)[0]
-                page_results = process_url(browser, page, args.follow, args.debug)
-                if page_results:
-                    results.append(page_results)
+        process_page = functools.partial(process_url, follow_links=args.follow, debug=args.debug,
+                                         aggregate_resources=args.aggregate_resources, precheck=args.precheck,
+                                         cache_check=args.cache_check, incremental=args.incremental,
+                                         load_strategy=args.load_strategy)
 
-                # Print progress information - to be improved.
-                sys.stdout.write('\033[2K\033[1G')
-                sys.stdout.flush()
-                print('({}/{})| {}'.format(proc_cnt, total, page.partition(domain_name )[2]), end='')
-                sys.stdout.flush()
+        # Browser sessions retry pages lost to a browser crash.
+        if args.engine == ENGINE_BROWSER:
+            process_page = functools.partial(BrowserSession.process, process_page=process_page)
 
-            else:
-                break
+        # Pages are checked on separate workers, so that browsers only wait for pages worth measuring.
+        check_page = functools.partial(check_url, follow_links=args.follow, precheck=args.precheck,
+                                       incremental=args.incremental, cache_check=args.cache_check)
 
-        report_results(results)
+        worker_pool = WorkerPool(url_mgmt, process_page, args.max, check_page, args.check_workers, args.queue_size)
+
+        # Links found by the other shards, until all shards are done.
+        if shard:
+            sources.append(shard.inbox(worker_pool))
+
+        worker_pool.run(browsers, show_progress, sources)
+
+        report_results()
 
     except Exception as ex:
         logging.error('Exception: %s', ex)
         traceback.print_exc()
 
     finally:
-        if browser:
+        google_insights.shutdown()
+        crawl_store.close(url_mgmt)
+        insights_cache.close()
+        url_mgmt.close_reports()
+
+        for browser in browsers:
             browser.quit()
 
+        if shard:
+            shard.close()
+
+        if profiler:
+            profiler.stop(url_mgmt.report_path('profile', 'prof'))
+
 
 if __name__ == '__main__':
     main()
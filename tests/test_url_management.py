@@ -0,0 +1,80 @@
+"""
+URL management tests, run with: python -m unittest
+"""
+import unittest
+
+from lib.url_management import UrlManagement, ALIAS_REDIRECT, ALIAS_CANONICAL
+
+
+class ResolveAliasTest(unittest.TestCase):
+    """Tests of 'UrlManagement.resolve_alias()'."""
+
+
+    def setUp(self):
+        self.url_mgmt = UrlManagement()
+        self.url_mgmt.set_domain_name('example')
+
+
+    def aliases(self):
+        return [(alias['url'], alias['page_url'], alias['type']) for alias in self.url_mgmt.alias_pages()]
+
+
+    def test_redirect(self):
+        self.url_mgmt.unprocessed_pages('http://example.com/a')
+        self.url_mgmt.unprocessed_pages('http://example.com/b')
+        url = self.url_mgmt.next_unprocessed_page()
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, 'http://example.com/b'), 'http://example.com/b')
+        self.assertEqual(self.aliases(), [('http://example.com/a', 'http://example.com/b', ALIAS_REDIRECT)])
+        self.assertIsNone(self.url_mgmt.next_unprocessed_page())
+
+
+    def test_canonical(self):
+        url = 'http://example.com/a/index.html'
+        self.url_mgmt.unprocessed_pages(url)
+        self.url_mgmt.next_unprocessed_page()
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, url, 'http://example.com/a'), 'http://example.com/a')
+        self.assertEqual(self.aliases(), [(url, 'http://example.com/a', ALIAS_CANONICAL)])
+
+
+    def test_redirect_to_self_canonical(self):
+        # E.g. http redirecting to https, with a canonical link back to the http URL.
+        url = 'http://example.com/a'
+        self.url_mgmt.unprocessed_pages(url)
+        self.url_mgmt.next_unprocessed_page()
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, 'https://example.com/a', url), 'https://example.com/a')
+        self.assertEqual(self.aliases(), [(url, 'https://example.com/a', ALIAS_REDIRECT)])
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, url, url), url)
+        self.assertEqual(len(self.aliases()), 1)
+
+
+    def test_redirect_with_canonical_back(self):
+        url = 'http://example.com/a'
+        self.url_mgmt.unprocessed_pages(url)
+        self.url_mgmt.next_unprocessed_page()
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, 'http://example.com/b', url), 'http://example.com/b')
+        self.assertEqual(self.aliases(), [(url, 'http://example.com/b', ALIAS_REDIRECT)])
+
+
+    def test_dead_canonical(self):
+        # The page is measured under its own URL, the canonical URL stays in the unreachable pages.
+        url = 'http://example.com/promo'
+        self.url_mgmt.unprocessed_pages(url)
+        self.url_mgmt.next_unprocessed_page()
+
+        self.assertEqual(self.url_mgmt.resolve_alias(url, url, 'http://example.com/gone'), 'http://example.com/gone')
+        self.url_mgmt.unreachable_pages('http://example.com/gone', 404)
+        self.assertTrue(self.url_mgmt.is_unreachable('http://example.com/gone'))
+
+        self.url_mgmt.drop_alias(url)
+        self.assertEqual(self.aliases(), [])
+        self.assertEqual(self.url_mgmt.state_changes().dropped_aliases, [url])
+        self.assertEqual([page['url'] for page in self.url_mgmt.unreachable_pages()], ['http://example.com/gone'])
+
+
+if __name__ == '__main__':
+    unittest.main()